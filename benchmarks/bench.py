@@ -0,0 +1,229 @@
+"""Benchmarks of fssync.
+
+    python -m benchmarks.bench --sizes 1000 10000 --output results.json
+    python -m benchmarks.bench --baseline results.json --tolerance 0.2
+    python -m benchmarks.bench --latency 0.002 --bandwidth 10000000
+
+Each benchmark runs over a synthetic library (see corpus) of each size,
+the results are the best seconds of --repeat runs, written as json.
+The sync and organize benchmarks see their filesystems through a
+LatencyFS, that adds the --latency and --bandwidth of a network share,
+and their calls to the filesystems (round trips) are also written.
+With --baseline the results are compared with a previous output and the
+exit code is 1 if some benchmark is slower than the tolerance allows or
+makes more calls to the filesystems.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from fs.memoryfs import MemoryFS
+from fs.tempfs import TempFS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from fssync.utils import rename, parse_serie_guessit, editDistance, parse_cache
+from fssync.dsync import SeriesAnimes, SeriesPerson
+from fssync.wrap import LatencyFS
+from benchmarks.corpus import names, build_tree, copy_tree
+
+SIZES = (1000, 10000, 100000)
+
+
+def _fs(kind):
+    return TempFS() if kind == 'temp' else MemoryFS()
+
+
+def _slow(fsi, ctx):
+    return LatencyFS(fsi, latency=ctx.latency, bandwidth=ctx.bandwidth)
+
+
+def _cold():
+    # the parsers are memoized, each run must parse again
+    parse_cache.clear()
+
+
+def bench_rename(n, ctx):
+    corpus = names(n, ctx.seed)
+    _cold()
+    t0 = time.perf_counter()
+    for name in corpus:
+        rename(name)
+    return time.perf_counter() - t0
+
+
+def bench_parse_serie_guessit(n, ctx):
+    corpus = names(n, ctx.seed)
+    _cold()
+    t0 = time.perf_counter()
+    for name in corpus:
+        try:
+            parse_serie_guessit(name)
+        except KeyError:
+            pass
+    return time.perf_counter() - t0
+
+
+def bench_editDistance(n, ctx):
+    corpus = names(n, ctx.seed)
+    rnd = random.Random(ctx.seed)
+    pairs = [(rnd.choice(corpus), rnd.choice(corpus)) for _ in range(n)]
+    t0 = time.perf_counter()
+    for a, b in pairs:
+        editDistance(a, b, lower=True)
+    return time.perf_counter() - t0
+
+
+def bench_make_temp_fs(n, ctx):
+    src = _fs(ctx.fs)
+    build_tree(src, n, ctx.seed)
+    tt = SeriesAnimes(src, MemoryFS())
+    _cold()
+    t0 = time.perf_counter()
+    tt._make_temp_fs(tt._source)
+    elapsed = time.perf_counter() - t0
+    src.close()
+    return elapsed
+
+
+def _bench_sync(klass, n, ctx):
+    src = _fs(ctx.fs)
+    dst = _fs(ctx.fs)
+    build_tree(src, n, ctx.seed)
+    src, dst = _slow(src, ctx), _slow(dst, ctx)
+    _cold()
+    t0 = time.perf_counter()
+    with klass(src, dst) as tt:
+        tt.sync(ctx.workers, ctx.use_hash)
+    return time.perf_counter() - t0, src.round_trips + dst.round_trips
+
+
+def bench_series_animes_sync(n, ctx):
+    return _bench_sync(SeriesAnimes, n, ctx)
+
+
+def bench_series_person_sync(n, ctx):
+    return _bench_sync(SeriesPerson, n, ctx)
+
+
+def bench_organize(n, ctx):
+    # SeriesAnimes organize names the files by title and episode only,
+    # the SxxEyy series of the mixed corpus would collide
+    src = MemoryFS()
+    build_tree(src, n, ctx.seed, kind='anime')
+    dst = _fs(ctx.fs)
+    copy_tree(src, dst)
+    dst = _slow(dst, ctx)
+    _cold()
+    t0 = time.perf_counter()
+    with SeriesAnimes(MemoryFS(), dst) as tt:
+        tt.organize()
+    return time.perf_counter() - t0, dst.round_trips
+
+
+BENCHMARKS = {
+    'rename': bench_rename,
+    'parse_serie_guessit': bench_parse_serie_guessit,
+    'editDistance': bench_editDistance,
+    '_make_temp_fs': bench_make_temp_fs,
+    'SeriesAnimes.sync': bench_series_animes_sync,
+    'SeriesPerson.sync': bench_series_person_sync,
+    'organize': bench_organize,
+}
+
+
+def run(ctx, report=print):
+    results = {}
+    calls = {}
+    for name in ctx.only or list(BENCHMARKS):
+        results[name] = {}
+        for n in ctx.sizes:
+            # the benchmarks over filesystems also return their round trips
+            runs = [BENCHMARKS[name](n, ctx) for _ in range(ctx.repeat)]
+            if isinstance(runs[0], tuple):
+                best = min(i[0] for i in runs)
+                calls.setdefault(name, {})[str(n)] = runs[0][1]
+                report('{:<22} {:>7} {:10.4f}s {:>9} calls'.format(name, n, best, runs[0][1]))
+            else:
+                best = min(runs)
+                report('{:<22} {:>7} {:10.4f}s'.format(name, n, best))
+            results[name][str(n)] = best
+    return {'meta': {'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'fs': ctx.fs, 'seed': ctx.seed, 'repeat': ctx.repeat,
+                     'workers': ctx.workers, 'use_hash': ctx.use_hash,
+                     'latency': ctx.latency, 'bandwidth': ctx.bandwidth,
+                     'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results,
+            'calls': calls}
+
+
+def compare(current, baseline, tolerance, report=print):
+    """Print current against baseline, return the benchmarks slower than
+    baseline*(1+tolerance) or with more calls to the filesystems"""
+    slower = []
+    for name, sizes in current['results'].items():
+        for n, seconds in sizes.items():
+            base = baseline['results'].get(name, {}).get(n)
+            if base is None:
+                continue
+            ratio = seconds/base if base else float('inf')
+            mark = ''
+            if ratio > 1 + tolerance:
+                mark = ' SLOWER'
+                slower.append((name, n, ratio))
+            elif ratio < 1 - tolerance:
+                mark = ' faster'
+            report('{:<22} {:>7} {:10.4f}s {:10.4f}s {:6.2f}x{}'.format(
+                name, n, base, seconds, ratio, mark))
+    # the round trips don't depend of the machine, any new call is a regression
+    for name, sizes in current.get('calls', {}).items():
+        for n, count in sizes.items():
+            base = baseline.get('calls', {}).get(name, {}).get(n)
+            if base is not None and count > base:
+                slower.append((name, n, count/base if base else float('inf')))
+                report('{:<22} {:>7} {:>9} calls {:>9} calls MORE CALLS'.format(
+                    name, n, base, count))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='fssync benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS))
+    parser.add_argument('--fs', choices=['memory', 'temp'], default='memory',
+                        help='filesystem of the trees, temp uses sparse files in disk')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--use-hash', action='store_true')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each call to the filesystems')
+    parser.add_argument('--bandwidth', type=int, default=None,
+                        help='bytes per second of the reads and writes of the files')
+    parser.add_argument('--output', help='write the results as json here')
+    parser.add_argument('--baseline', help='results json to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    ctx = parser.parse_args(argv)
+
+    current = run(ctx)
+    if ctx.output:
+        with open(ctx.output, 'w') as afile:
+            json.dump(current, afile, indent=2)
+    else:
+        print(json.dumps(current, indent=2))
+    if ctx.baseline:
+        with open(ctx.baseline) as afile:
+            baseline = json.load(afile)
+        if compare(current, baseline, ctx.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Generator of synthetic media libraries for the benchmarks.
+
+The names mimic what arrives from the trackers: fansub tags, resolutions,
+SxxEyy series, spanish "capitulo" names, and subtitles and covers mixed
+with the videos. The same seed always gives the same corpus.
+"""
+import os
+import random
+from fs.path import join
+
+TITLES = ['Naruto', 'Naruto Shippuden', 'Bleach', 'One Piece', 'Boku no Hero Academia',
+          'Shingeki no Kyojin', 'Dr. Stone', 'Kimetsu no Yaiba', 'Dragon Ball Super',
+          'Hunter x Hunter', 'Fullmetal Alchemist Brotherhood', 'Death Note',
+          'Tokyo Ghoul', 'Sword Art Online', 'Fairy Tail', 'Black Clover', 'Mob Psycho 100',
+          'Vinland Saga', 'Made in Abyss', 'Steins Gate', 'Re Zero', 'Overlord',
+          'Friends', 'Dark', 'Breaking Bad', 'The Office', 'Game of Thrones',
+          'Stranger Things', 'Better Call Saul', 'The Expanse', 'Mr Robot',
+          'La Casa de Papel', 'Chernobyl', 'The Mandalorian', 'Westworld', 'Lost']
+TAGS = ['HS', 'HorribleSubs', 'Erai-raws', 'SubsPlease', 'Judas', 'EMBER', 'Cleo',
+        'AnimeRG', 'Kaerizaki-Fansub', 'Fumetsu no Fansub']
+RESOLUTIONS = ['480p', '720p', '1080p', '2160p']
+SOURCES = ['WEB-DL', 'HDTV', 'BluRay', 'WEBRip']
+CODECS = ['x264', 'x265', 'HEVC', 'AAC']
+GROUPS = ['LOL', 'DIMENSION', 'NTb', 'RARBG', 'FLEET', 'AMZN']
+VIDEO = ['.mkv', '.mp4', '.avi']
+SUBS = ['.srt', '.ass', '.ssa']
+IMAGES = ['.jpg', '.png']
+
+
+def _anime(rnd, title, ep):
+    style = rnd.randrange(5)
+    if style == 0:
+        return '[{}] {} - {:02d} [{}]'.format(rnd.choice(TAGS), title, ep,
+                                              rnd.choice(RESOLUTIONS))
+    if style == 1:
+        return '[{}] {} - {:02d} ({} {}) [{:08X}]'.format(
+            rnd.choice(TAGS), title, ep, rnd.choice(SOURCES), rnd.choice(RESOLUTIONS),
+            rnd.getrandbits(32))
+    if style == 2:
+        return '{} Capitulo {}'.format(title, ep)
+    if style == 3:
+        return '{} {:03d} {}'.format(title, ep, rnd.choice(RESOLUTIONS))
+    return '[{}] {} Episodio {:02d}'.format(rnd.choice(TAGS), title, ep)
+
+
+def _series(rnd, title, season, ep):
+    style = rnd.randrange(4)
+    dotted = title.replace(' ', '.')
+    if style == 0:
+        return '{}.S{:02d}E{:02d}.{}.{}.{}-{}'.format(
+            dotted, season, ep, rnd.choice(RESOLUTIONS), rnd.choice(SOURCES),
+            rnd.choice(CODECS), rnd.choice(GROUPS))
+    if style == 1:
+        return '{} - {}x{:02d}'.format(title, season, ep)
+    if style == 2:
+        return '{}.S{:02d}E{:02d}'.format(dotted, season, ep)
+    return '{} Temporada {} Capitulo {}'.format(title, season, ep)
+
+
+def names(n, seed=0, kind='mixed'):
+    """List of n file names, kind is 'anime', 'series' or 'mixed'.
+    About one of each five videos has its subtitle and some folders a cover."""
+    rnd = random.Random(seed)
+    res = []
+    # the episodes of each title continue from the last batch, like a
+    # library that grows, so two files are never the same episode
+    last = {}
+    while len(res) < n:
+        title = rnd.choice(TITLES)
+        first = last.get(title, 0) + 1
+        end = last[title] = first + rnd.randint(1, 59)
+        if rnd.random() < 0.3:
+            title = title.lower()
+        anime = kind == 'anime' or (kind == 'mixed' and rnd.random() < 0.5)
+        season = rnd.randint(1, 8)
+        for ep in range(first, end):
+            if anime:
+                stem = _anime(rnd, title, ep)
+            else:
+                stem = _series(rnd, title, season, ep)
+            res.append(stem + rnd.choice(VIDEO))
+            if rnd.random() < 0.2:
+                res.append(stem + rnd.choice(SUBS))
+            if len(res) >= n:
+                break
+        if rnd.random() < 0.1:
+            res.append('cover' + rnd.choice(IMAGES))
+    return res[:n]
+
+
+def _write(fsi, path, size, sparse):
+    if sparse:
+        try:
+            syspath = fsi.getsyspath(path)
+        except Exception:
+            syspath = None
+        if syspath is not None:
+            # a hole of size bytes, no disk nor time spent
+            with open(syspath, 'wb') as afile:
+                afile.truncate(size)
+            return
+    fsi.writebytes(path, b'\0'*size)
+
+
+def build_tree(fsi, n, seed=0, kind='mixed', sizes=(1, 4096), per_folder=500,
+               sparse=True):
+    """Write n files in fsi, spread in folders of per_folder files.
+    The size of each file is random between sizes, the files are sparse
+    where the filesystem is of the OS.
+    Return the list of paths."""
+    rnd = random.Random(seed)
+    paths = []
+    for i, name in enumerate(names(n, seed, kind)):
+        folder = join('/', 'download {}'.format(i//per_folder))
+        if i % per_folder == 0:
+            fsi.makedirs(folder, recreate=True)
+        path = join(folder, name)
+        if fsi.exists(path):
+            continue
+        _write(fsi, path, rnd.randint(*sizes), sparse)
+        paths.append(path)
+    return paths
+
+
+def copy_tree(src, dst):
+    """Copy all the files of src in the root of dst, flat, like a messy
+    download folder for organize"""
+    for path in src.walk.files():
+        name = os.path.basename(path)
+        if not dst.exists(join('/', name)):
+            dst.writebytes(join('/', name), src.readbytes(path))
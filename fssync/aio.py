@@ -0,0 +1,150 @@
+import asyncio
+import threading
+from collections import namedtuple
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from fs.errors import BulkCopyFailed
+from .copier import Copier, CopyCancelled
+
+ProgressEvent = namedtuple('ProgressEvent', ['src', 'dest', 'count', 'total',
+                                             'speed', 'finish'])
+
+
+class Progress(object):
+    """Async iterator of the ProgressEvents of an async sync.
+
+    The copies run in other threads, the events are passed to the event
+    loop and the iteration ends when the sync finish.
+
+    :param maxsize: max events not consumed yet, the older are dropped
+        when it is reached (0 is unlimited)
+    """
+
+    _END = object()
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._loop = None
+        self._queue = None
+        self._closed = False
+
+    def _bind(self, loop):
+        if self._loop is None:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+
+    def _put(self, event):
+        if self.maxsize and self._queue.qsize() >= self.maxsize and event is not self._END:
+            # a slow consumer must not stop the copies
+            self._queue.get_nowait()
+        self._queue.put_nowait(event)
+
+    def push(self, count_callback):
+        """Send the state of a CountCallback, can be called from any thread"""
+        if self._loop is None or self._closed:
+            return
+        c = count_callback
+        event = ProgressEvent(c.src, c.dest, c.count, c.total, c.speed, c.finish)
+        self._loop.call_soon_threadsafe(self._put, event)
+
+    def close(self):
+        if self._loop is None or self._closed:
+            return
+        self._closed = True
+        self._loop.call_soon_threadsafe(self._put, self._END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._queue is None:
+            self._bind(asyncio.get_running_loop())
+        event = await self._queue.get()
+        if event is self._END:
+            raise StopAsyncIteration
+        return event
+
+
+async def execute_plan_async(plan, src_fs, dst_fs, copier=None, concurrency=1,
+                             callback=None, progress=None, executor=None,
+                             semaphore=None):
+    """Run a SyncPlan from a coroutine.
+
+    The filesystem calls run in executor (a ThreadPoolExecutor of
+    concurrency threads by default), at most concurrency copies run at the
+    same time, and all the syncs that share semaphore (an asyncio.Semaphore)
+    together. Cancel the coroutine stops the running copies at their next
+    chunk.
+
+    :param copier: Copier used to copy each file, its workers are not used
+    :param callback: called with the CountCallback of each chunk, in the
+        thread of the copy
+    :param progress: Progress that receives the events of the copies
+    """
+    loop = asyncio.get_running_loop()
+    own = executor is None
+    if own:
+        executor = ThreadPoolExecutor(max_workers=max(concurrency, 1))
+    if copier is None:
+        copier = Copier(num_workers=0)
+    if progress is not None:
+        progress._bind(loop)
+    cancel = threading.Event()
+    errors = []
+
+    def run(func, *args, **kwargs):
+        return loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    def chunk(count_callback):
+        if cancel.is_set():
+            raise CopyCancelled(count_callback.src)
+        if callback is not None:
+            callback(count_callback)
+        if progress is not None:
+            progress.push(count_callback)
+
+    async def copy(op):
+        await run(copier.copy, src_fs, op.src, dst_fs, op.dst, chunk,
+                  size=op.size or None)
+
+    async def worker(pending):
+        while pending and not cancel.is_set():
+            op = pending.pop()
+            try:
+                if semaphore is None:
+                    await copy(op)
+                else:
+                    async with semaphore:
+                        await copy(op)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors.append(e)
+
+    workers = []
+    try:
+        for path in plan.folders:
+            if not await run(dst_fs.exists, path):
+                await run(dst_fs.makedir, path)
+        renames, copies = plan.ordered()
+        for op in renames:
+            await run(dst_fs.move, op.dst, op.rename_to)
+        # the operations have size like the copy tasks, the policy
+        # orders them the same, reversed because the workers pop
+        pending = list(reversed(copier.schedule(copies)))
+        workers = [asyncio.ensure_future(worker(pending))
+                   for _ in range(max(concurrency, 1))]
+        await asyncio.gather(*workers)
+    except asyncio.CancelledError:
+        cancel.set()
+        for i in workers:
+            i.cancel()
+        raise
+    finally:
+        if progress is not None:
+            progress.close()
+        if own:
+            # wait that the copies in the threads see the cancel and stop
+            await loop.run_in_executor(None, executor.shutdown)
+    if errors:
+        raise BulkCopyFailed(errors)
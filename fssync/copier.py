@@ -1,8 +1,126 @@
+from fs import open_fs
 from fs.bulk import Copier as fsCopier
+from fs.errors import BulkCopyFailed
+from fs.wrapfs import WrapFS
+import io
+import os
+import sys
+import json
 import time
+import errno
+import threading
+from queue import Full
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
 
+# errors of copy_file_range/sendfile that mean "not supported for this
+# pair of files", the copy is done with the buffered loop
+_NO_ZERO_COPY = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                 errno.EBADF, errno.ENOTSUP, errno.ESPIPE, errno.ENOTSOCK}
+# sendfile of linux is the only one that writes to regular files, on macOS
+# and the BSDs the destination must be a socket
+_HAS_SENDFILE = hasattr(os, 'sendfile') and sys.platform.startswith('linux')
+_HAS_ZERO_COPY = hasattr(os, 'copy_file_range') or _HAS_SENDFILE
 
-def copy_file_data(src_file, dst_file, chunk_size=None, callback=None):
+
+CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+# seconds of copy measured before each change of the chunk size
+CHUNK_WINDOW = 0.5
+# weight of the last chunk in the speed of CountCallback
+SPEED_ALPHA = 0.3
+
+
+def fs_inner(fsi):
+    """Filesystem behind the wrappers"""
+    while isinstance(fsi, WrapFS):
+        fsi = fsi.delegate_fs()
+    return fsi
+
+
+def fs_kind(fsi):
+    """Name of the filesystem class behind the wrappers"""
+    return type(fs_inner(fsi)).__name__
+
+
+class ChunkSizer(object):
+    """Chunk size of the copies for each kind of source and destination,
+    adapted to the measured throughput.
+
+    Every CHUNK_WINDOW seconds of copy the size moves (x2 or /2) in the
+    direction that didn't make the throughput worse, between minimum and
+    maximum, so each backend settles near its best chunk size.
+
+    :param initial: first chunk size of each kind
+    """
+
+    def __init__(self, initial=CHUNK_SIZE, minimum=MIN_CHUNK_SIZE,
+                 maximum=MAX_CHUNK_SIZE, window=CHUNK_WINDOW):
+        self.initial = min(max(initial, minimum), maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self._lock = threading.Lock()
+        # key -> [size, direction, last speed, bytes, seconds]
+        self._state = {}
+
+    def size(self, key):
+        state = self._state.get(key)
+        return self.initial if state is None else state[0]
+
+    def record(self, key, nbytes, seconds):
+        """Account nbytes copied in seconds with the current size of key"""
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                state = [self.initial, 1, None, 0, 0.0]
+                self._state[key] = state
+            state[3] += nbytes
+            state[4] += seconds
+            if state[4] < self.window:
+                return
+            size, direction, last, nbytes, seconds = state
+            speed = nbytes/seconds
+            if last is not None and speed < last*0.95:
+                direction = -direction
+            new = size*2 if direction > 0 else size//2
+            new = min(max(new, self.minimum), self.maximum)
+            if new == size:
+                direction = -direction
+            self._state[key] = [new, direction, speed, 0, 0.0]
+
+    @property
+    def sizes(self):
+        return {key: state[0] for key, state in self._state.items()}
+
+
+# resumable copies are written to path+PART_SUFFIX, path+CHECKPOINT_SUFFIX
+# saves the bytes already written and the source they come from
+PART_SUFFIX = '.part'
+CHECKPOINT_SUFFIX = '.part.ckpt'
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+RESUME_MIN_SIZE = 64 * 1024 * 1024
+# bytes compared at the start and the end of a prefix before resume it
+RESUME_SAMPLE = 64 * 1024
+
+
+_buffers = threading.local()
+
+
+def get_buffer(size):
+    """bytearray of at least size bytes owned by the current thread, reused
+    by all the copies of the thread (each worker allocate its buffer once)"""
+    buff = getattr(_buffers, 'buffer', None)
+    if buff is None or len(buff) < size:
+        buff = bytearray(size)
+        _buffers.buffer = buff
+    return buff
+
+
+def copy_file_data(src_file, dst_file, chunk_size=None, callback=None,
+                   sizer=None, key=None):
     # type: (IO, IO, Optional[int]) -> None
     """Copy data from one file object to another.
 
@@ -11,30 +129,190 @@ def copy_file_data(src_file, dst_file, chunk_size=None, callback=None):
         dst_file (io.IOBase): File open for writing.
         chunk_size (int): Number of bytes to copy at
             a time (or `None` to use sensible default).
+        sizer (ChunkSizer): If given, the chunk size of key
+            is taken from it and each chunk is measured.
 
     """
-    _chunk_size = 1024 * 1024 if chunk_size is None else chunk_size
+    _chunk_size = CHUNK_SIZE if chunk_size is None else chunk_size
+    if callback is None:
+        callback = do_nothing
+    readinto = getattr(src_file, 'readinto', None)
+    if readinto is None:
+        return _copy_file_chunks(src_file, dst_file, _chunk_size, callback,
+                                 sizer, key)
+    view = memoryview(get_buffer(sizer.maximum if sizer else _chunk_size))
+    write = dst_file.write
+    size = sizer.size(key) if sizer else _chunk_size
+    t0 = perf_counter()
+    try:
+        n = readinto(view[:size])
+    except (NotImplementedError, io.UnsupportedOperation):
+        # some file objects have readinto only by inheritance
+        return _copy_file_chunks(src_file, dst_file, _chunk_size, callback,
+                                 sizer, key)
+    while n:
+        chunk = view[:n]
+        written = write(chunk)
+        # raw files can write less than asked
+        while written is not None and written < n:
+            written += write(chunk[written:])
+        if sizer:
+            sizer.record(key, n, perf_counter() - t0)
+            size = sizer.size(key)
+        callback(n)
+        t0 = perf_counter()
+        n = readinto(view[:size])
+
+
+def _copy_file_chunks(src_file, dst_file, chunk_size, callback, sizer=None, key=None):
+    """copy_file_data for file objects without readinto (text files)"""
     read = src_file.read
     write = dst_file.write
-    # The 'or None' is so that it works with binary and text files
-    for chunk in iter(lambda: read(_chunk_size) or None, None):
+    size = sizer.size(key) if sizer else chunk_size
+    t0 = perf_counter()
+    chunk = read(size)
+    while chunk:
         write(chunk)
+        if sizer:
+            sizer.record(key, len(chunk), perf_counter() - t0)
+            size = sizer.size(key)
         callback(len(chunk))
+        t0 = perf_counter()
+        chunk = read(size)
+
+
+def _kernel_copy(src_fd, dst_fd, count):
+    """Copy up to count bytes between the current positions of the file
+    descriptors inside the kernel, return the bytes copied (0 at eof)"""
+    if hasattr(os, 'copy_file_range'):
+        return os.copy_file_range(src_fd, dst_fd, count)
+    # sendfile don't move the position of the source
+    offset = os.lseek(src_fd, 0, os.SEEK_CUR)
+    copied = os.sendfile(dst_fd, src_fd, offset, count)
+    os.lseek(src_fd, offset + copied, os.SEEK_SET)
+    return copied
+
+
+def copy_file_zero(src_file, dst_file, chunk_size=None, callback=None,
+                   sizer=None, key=None):
+    """Copy data from one file object to another without pass it through
+    python (copy_file_range or sendfile), when the files are OS files.
+    Fallback to copy_file_data if the kernel can't copy between them.
+    callback is called after each chunk with its size."""
+    _chunk_size = CHUNK_SIZE if chunk_size is None else chunk_size
+    if callback is None:
+        callback = do_nothing
+    try:
+        src_fd = src_file.fileno()
+        dst_fd = dst_file.fileno()
+    except (AttributeError, OSError, ValueError):
+        return copy_file_data(src_file, dst_file, _chunk_size, callback, sizer, key)
+    if not _HAS_ZERO_COPY:
+        return copy_file_data(src_file, dst_file, _chunk_size, callback, sizer, key)
+    total = 0
+    while True:
+        size = sizer.size(key) if sizer else _chunk_size
+        t0 = perf_counter()
+        try:
+            copied = _kernel_copy(src_fd, dst_fd, size)
+        except OSError as e:
+            if total == 0 and e.errno in _NO_ZERO_COPY:
+                return copy_file_data(src_file, dst_file, _chunk_size, callback,
+                                      sizer, key)
+            raise
+        if not copied:
+            break
+        if sizer:
+            sizer.record(key, copied, perf_counter() - t0)
+        total += copied
+        callback(copied)
 
 
 def do_nothing(a):
     pass
 
 
+class CopyCancelled(Exception):
+    """Raised by a progress callback to stop its copy"""
+    pass
+
+
+class TokenBucket(object):
+    """Bandwidth limit shared by the copies that use it.
+
+    Each copied chunk takes its size in tokens, the tokens come back at
+    rate bytes per second up to burst. A chunk bigger than the available
+    tokens leaves the bucket in debt and the copy sleeps until it is paid.
+
+    :param rate: bytes per second, None or 0 is unlimited
+    :param burst: max tokens saved while idle, by default one second of rate
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self._lock = threading.Lock()
+        self._burst = burst
+        self.rate = None
+        self.tokens = 0.0
+        self.last = perf_counter()
+        # measured rate
+        self.actual = 0.0
+        self._window_start = self.last
+        self._window_bytes = 0
+        self.set_rate(rate, burst)
+
+    @property
+    def burst(self):
+        if self._burst is not None:
+            return self._burst
+        return self.rate or 0
+
+    def set_rate(self, rate, burst=None):
+        """Change the limit, can be called while the copies are running"""
+        with self._lock:
+            self.rate = rate or None
+            if burst is not None:
+                self._burst = burst
+            self.tokens = min(self.tokens, self.burst)
+
+    def _measure(self, nbytes, now):
+        self._window_bytes += nbytes
+        elapsed = now - self._window_start
+        if elapsed >= CHUNK_WINDOW:
+            speed = self._window_bytes/elapsed
+            self.actual = speed if not self.actual else 0.5*self.actual + 0.5*speed
+            self._window_start = now
+            self._window_bytes = 0
+
+    def consume(self, nbytes):
+        """Take nbytes tokens, sleep while the bucket is in debt"""
+        with self._lock:
+            now = perf_counter()
+            rate = self.rate
+            if rate:
+                self.tokens = min(self.tokens + (now - self.last)*rate, self.burst)
+                self.tokens -= nbytes
+                wait = -self.tokens/rate if self.tokens < 0 else 0
+            else:
+                wait = 0
+            self.last = now
+            self._measure(nbytes, now)
+        if wait:
+            time.sleep(wait)
+
+
 class CountCallback(object):
 
-    __slots__ = ('total', 'count', 'timeit', 'timeitold', 'speedd', 'callback', 'src_fs', 'dst_fs', 'src', 'dest')
+    __slots__ = ('total', 'count', 'timeit', 'timeitold', 'speedd', 'callback', 'src_fs', 'dst_fs', 'src', 'dest',
+                 'bucket', 'resumed')
 
-    def __init__(self, total, src, dest, callback=None):
+    def __init__(self, total, src, dest, callback=None, bucket=None):
         self.src_fs = None
         self.dst_fs = None
+        self.bucket = bucket
         self.total = total
         self.count = 0
+        # bytes kept from a previous interrupted copy, not copied now
+        self.resumed = 0
         self.timeit = time.time()
         self.timeitold = 0
         self.speedd = 0
@@ -47,6 +325,9 @@ class CountCallback(object):
 
     @property
     def percent(self):
+        if not self.total:
+            # an empty file is done from the start
+            return 100.0
         return (self.count/self.total)*100
 
     @property
@@ -57,64 +338,613 @@ class CountCallback(object):
     def speed(self):
         return self.speedd
 
+    @property
+    def target_rate(self):
+        """Bandwidth limit of the destination in bytes/s, None if unlimited"""
+        return self.bucket.rate if self.bucket is not None else None
+
+    @property
+    def actual_rate(self):
+        """Measured bytes/s of all the copies to the destination"""
+        return self.bucket.actual if self.bucket is not None else None
+
+    def start(self):
+        """Mark the start of the copy, the time in the queue isn't speed"""
+        self.timeit = time.time()
+
+    def resume(self, offset):
+        """Start the count at offset, the bytes of a resumed copy are
+        reported but they don't change the speed"""
+        self.count = self.resumed = offset
+        self.callback(self)
+
     def __call__(self, chunk):
         self.count += chunk
-        t1 = self.timeitold
-        t2 = self.timeit
-        t1 = t2
-        t2 = time.time()
-        self.speedd = chunk/(t2-t1)
+        self.timeitold = self.timeit
+        self.timeit = time.time()
+        elapsed = self.timeit - self.timeitold
+        if elapsed > 0:
+            # smoothed, the speed of a single chunk is too noisy
+            speed = chunk/elapsed
+            self.speedd = speed if not self.speedd else \
+                SPEED_ALPHA*speed + (1 - SPEED_ALPHA)*self.speedd
         self.callback(self)
 
 
+def _source_stamp(fsi, path):
+    info = fsi.getinfo(path, namespaces=['details'])
+    modified = info.modified
+    return {'size': info.size,
+            'mtime': modified.timestamp() if modified is not None else None}
+
+
+def _read_at(afile, offset, size):
+    afile.seek(offset)
+    parts = []
+    while size:
+        buf = afile.read(size)
+        if not buf:
+            break
+        parts.append(buf)
+        size -= len(buf)
+    return b''.join(parts)
+
+
+def _prefix_matches(src_file, part_file, offset, sample=RESUME_SAMPLE):
+    """True if the first and the last sample bytes of the prefix of
+    length offset are the same in both files"""
+    for start in (0, max(0, offset - sample)):
+        size = min(sample, offset - start)
+        if _read_at(src_file, start, size) != _read_at(part_file, start, size):
+            return False
+    return True
+
+
 class _CopyTask(object):
-    """A callable that copies from one file another."""
-    def __init__(self, src_file, dst_file, callback=None):
-        self.src_file = src_file
-        self.dst_file = dst_file
+    """A callable that copies from one file another.
+    The files are opened when the task runs, so the pending tasks don't
+    hold open handles."""
+    def __init__(self, src_fs, src_path, dst_fs, dst_path, size=0, callback=None,
+                 zero_copy=False, chunk_size=CHUNK_SIZE, sizer=None, key=None,
+                 buckets=(), resume=False, pools=(None, None)):
+        self.src_fs = src_fs
+        self.src_path = src_path
+        self.dst_fs = dst_fs
+        self.dst_path = dst_path
+        self.size = size
         self.callback = callback
+        self.zero_copy = zero_copy
+        self.chunk_size = chunk_size
+        self.sizer = sizer
+        self.key = key
+        # TokenBuckets or functions that return the bucket of the worker
+        self.buckets = buckets
+        self.resume = resume
+        # ConnectionPools of the source and destination, or None
+        self.pools = pools
+
+    def _start(self):
+        start = getattr(self.callback, 'start', None)
+        if start is not None:
+            start()
+
+    def _throttled(self):
+        buckets = [i() if callable(i) else i for i in self.buckets]
+        buckets = [i for i in buckets if i is not None]
+        callback = self.callback or do_nothing
+        if not buckets:
+            return callback
+
+        def throttled(nbytes):
+            for bucket in buckets:
+                bucket.consume(nbytes)
+            callback(nbytes)
+        return throttled
 
     def __repr__(self):
-        return 'CopyTask(%r, %r)'.format(
-            self.src_file,
-            self.dst_file,
+        return 'CopyTask({!r}, {!r})'.format(
+            self.src_path,
+            self.dst_path,
         )
 
+    def _resume_offset(self, src_file, part, checkpoint, stamp):
+        """Bytes of part that can be kept, 0 if it must be copied again"""
+        dst_fs = self.dst_fs
+        try:
+            if not (dst_fs.exists(part) and dst_fs.exists(checkpoint)):
+                return 0
+            data = json.loads(dst_fs.readtext(checkpoint))
+            offset = data['offset']
+            if data['size'] != stamp['size'] or data['mtime'] != stamp['mtime']:
+                return 0
+            if not (0 < offset <= stamp['size']) or not src_file.seekable():
+                return 0
+            if dst_fs.getinfo(part, namespaces=['details']).size < offset:
+                return 0
+            with dst_fs.openbin(part, 'r') as part_file:
+                if not _prefix_matches(src_file, part_file, offset):
+                    return 0
+            return offset
+        except Exception:
+            return 0
+
+    def _checkpointed(self, callback, dst_file, checkpoint, stamp, offset):
+        """callback that saves the written bytes each CHECKPOINT_BYTES"""
+        state = [offset, offset + CHECKPOINT_BYTES]
+        dst_fs = self.dst_fs
+
+        def save():
+            dst_file.flush()
+            data = dict(stamp, offset=state[0], src=self.src_path)
+            dst_fs.writetext(checkpoint, json.dumps(data))
+
+        def checkpointed(nbytes):
+            state[0] += nbytes
+            if state[0] >= state[1]:
+                save()
+                state[1] = state[0] + CHECKPOINT_BYTES
+            callback(nbytes)
+        save()
+        return checkpointed
+
+    def _copy_resumable(self):
+        """Copy to dst_path+PART_SUFFIX continuing a previous interrupted
+        copy of the same source, and move it to dst_path at the end"""
+        dst_fs = self.dst_fs
+        part = self.dst_path + PART_SUFFIX
+        checkpoint = self.dst_path + CHECKPOINT_SUFFIX
+        stamp = _source_stamp(self.src_fs, self.src_path)
+        src_file = self.src_fs.openbin(self.src_path, 'r')
+        try:
+            offset = self._resume_offset(src_file, part, checkpoint, stamp)
+            dst_file = dst_fs.openbin(part, 'r+' if offset else 'w')
+        except Exception as e:
+            src_file.close()
+            print(e)
+            raise
+        copy = copy_file_zero if self.zero_copy else copy_file_data
+        self._start()
+        try:
+            src_file.seek(offset)
+            if offset:
+                dst_file.seek(offset)
+                dst_file.truncate()
+                # the resumed bytes are done, but they were not copied now
+                resume = getattr(self.callback, 'resume', None)
+                if resume is not None:
+                    resume(offset)
+            callback = self._checkpointed(self._throttled(), dst_file,
+                                          checkpoint, stamp, offset)
+            copy(
+                src_file, dst_file, chunk_size=self.chunk_size,
+                callback=callback, sizer=self.sizer, key=self.key
+            )
+        finally:
+            # after an error or a cancel the part and its checkpoint are
+            # kept for the next try
+            try:
+                src_file.close()
+            finally:
+                dst_file.close()
+        dst_fs.move(part, self.dst_path, overwrite=True)
+        dst_fs.remove(checkpoint)
+
     def __call__(self):
+        src_pool, dst_pool = self.pools
+        if src_pool is None and dst_pool is None:
+            return self._copy()
+        # the copy uses its own connections, leased only while it runs
+        src_fs, dst_fs = self.src_fs, self.dst_fs
+        try:
+            with _leased(src_pool, src_fs) as src, _leased(dst_pool, dst_fs) as dst:
+                self.src_fs, self.dst_fs = src, dst
+                return self._copy()
+        finally:
+            self.src_fs, self.dst_fs = src_fs, dst_fs
+
+    def _copy(self):
+        if self.resume:
+            return self._copy_resumable()
+        src_file = self.src_fs.openbin(self.src_path, 'r')
         try:
-            copy_file_data(
-                self.src_file, self.dst_file, chunk_size=1024 * 1024,
-                callback=self.callback
+            dst_file = self.dst_fs.openbin(self.dst_path, 'w')
+        except Exception as e:
+            # If dst file fails to open, explicitly close src_file
+            src_file.close()
+            print(e)
+            raise
+        copy = copy_file_zero if self.zero_copy else copy_file_data
+        self._start()
+        cancelled = False
+        try:
+            copy(
+                src_file, dst_file, chunk_size=self.chunk_size,
+                callback=self._throttled(), sizer=self.sizer, key=self.key
             )
+            if not self.size and self.callback:
+                # empty files never call back from the copy loop
+                self.callback(0)
+        except CopyCancelled:
+            cancelled = True
         except Exception as e:
             print(e)
         finally:
             try:
-                self.src_file.close()
+                src_file.close()
             finally:
-                self.dst_file.close()
+                dst_file.close()
+        if cancelled:
+            # a cancelled copy leaves no truncated file with the final name
+            try:
+                self.dst_fs.remove(self.dst_path)
+            except Exception:
+                pass
+            raise CopyCancelled(self.src_path)
+
+
+class CallbackPump(object):
+    """Progress callback for copies in many workers that calls callback
+    only in the thread that created it (usually the thread of the sync).
+
+    The workers only queue their CountCallbacks, the owner thread calls
+    pump to run callback for them. A CountCallback that change several
+    times before a pump is reported once, with its last state.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.owner = threading.current_thread()
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._queued = set()
+
+    def __call__(self, count_callback):
+        if threading.current_thread() is self.owner:
+            self.pump()
+            self.callback(count_callback)
+            return
+        with self._lock:
+            if id(count_callback) in self._queued:
+                return
+            self._queued.add(id(count_callback))
+            self._queue.append(count_callback)
+
+    def pump(self):
+        """Run callback for the queued copies, only from the owner thread"""
+        while True:
+            with self._lock:
+                if not self._queue:
+                    return
+                count_callback = self._queue.popleft()
+                self._queued.discard(id(count_callback))
+            self.callback(count_callback)
+
+
+class ConnectionPool(object):
+    """Connections (filesystem instances) of a backend that is not thread
+    safe, so many workers can copy from or to it at the same time.
+
+    Each copy leases a connection, only its thread uses it until the copy
+    ends and it goes back to the pool. A lease waits while size
+    connections are leased, the connections idle more than idle_timeout
+    seconds are closed.
+
+    :param opener: fs url or function that returns a new filesystem
+    :param size: max connections open at the same time
+    :param idle_timeout: seconds an unused connection is kept open,
+        None keeps it until close
+    """
+
+    def __init__(self, opener, size=4, idle_timeout=60.0):
+        assert size > 0
+        self.opener = opener
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        # (connection, time of release), the last released at the end
+        self._idle = []
+        self._open = 0
+        self._closed = False
+
+    @property
+    def open_connections(self):
+        return self._open
+
+    def _connect(self):
+        if callable(self.opener):
+            return self.opener()
+        return open_fs(self.opener)
+
+    def _expired(self, now):
+        """Take out of the pool the idle connections too old"""
+        if self.idle_timeout is None:
+            return []
+        old = [i for i, last in self._idle if now - last >= self.idle_timeout]
+        if old:
+            self._idle = [i for i in self._idle if now - i[1] < self.idle_timeout]
+            self._open -= len(old)
+        return old
+
+    def acquire(self):
+        """A connection for the current thread, release it after use"""
+        old = []
+        try:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise ValueError('the pool is closed')
+                    old += self._expired(time.time())
+                    if self._idle:
+                        conn = self._idle.pop()[0]
+                        break
+                    if self._open < self.size:
+                        self._open += 1
+                        conn = None
+                        break
+                    self._cond.wait()
+                if old:
+                    self._cond.notify_all()
+        finally:
+            _close_all(old)
+        if conn is not None:
+            return conn
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        """Give back a connection, a broken one is closed"""
+        with self._cond:
+            keep = not (broken or self._closed)
+            if keep:
+                self._idle.append((conn, time.time()))
+            else:
+                self._open -= 1
+            old = self._expired(time.time())
+            self._cond.notify()
+        _close_all(old if keep else old + [conn])
+
+    @contextmanager
+    def lease(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+
+    def close(self):
+        """Close the idle connections, the leased ones are closed when
+        released"""
+        with self._cond:
+            self._closed = True
+            idle = [i for i, _ in self._idle]
+            self._idle = []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        _close_all(idle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _close_all(connections):
+    for conn in connections:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+@contextmanager
+def _leased(pool, fsi):
+    """A connection of pool, or fsi without pool"""
+    if pool is None:
+        yield fsi
+        return
+    with pool.lease() as conn:
+        yield conn
+
+
+def fifo(tasks):
+    """Scheduling policy: the tasks in the order they were added"""
+    return list(tasks)
+
+
+def largest_first(tasks):
+    """Scheduling policy: biggest files first (LPT), no big file is left
+    alone at the end while the other workers are idle"""
+    return sorted(tasks, key=lambda task: task.size, reverse=True)
+
+
+def mixed_lanes(tasks):
+    """Scheduling policy: alternate the biggest and the smallest files,
+    the small ones keep the progress moving while the big ones copy"""
+    tasks = largest_first(tasks)
+    res = []
+    lo, hi = 0, len(tasks) - 1
+    while lo <= hi:
+        res.append(tasks[lo])
+        if lo != hi:
+            res.append(tasks[hi])
+        lo += 1
+        hi -= 1
+    return res
+
+
+def _local(fsi, path):
+    """True if path of fsi is a file of the OS"""
+    try:
+        return fsi.hassyspath(path)
+    except Exception:
+        return False
 
 
 class Copier(fsCopier):
+    """fs.bulk.Copier with progress callbacks.
+
+    :param chunk_size: bytes copied at a time
+    :param adaptive: True or a ChunkSizer (to share what it learned
+        between copiers) adapts the chunk size to each kind of filesystems
+    :param schedule: policy, a function that receives the pending tasks
+        (they have a size attribute) and return them in the order to copy.
+        With other policy than fifo the copies are queued when flush or
+        stop are called.
+    :param pump: function called by the thread of copy and stop while it
+        waits for the workers, see CallbackPump
+    :param rate: bandwidth limit in bytes/s of each destination filesystem,
+        or a TokenBucket shared by all the destinations
+    :param worker_rate: bandwidth limit in bytes/s of each worker
+    :param resume: files of resume_min_size or more are written to a
+        .part file with checkpoints, a copy interrupted continues from the
+        last checkpoint the next time and the file is moved in place at
+        the end
+    :param pools: dict of filesystem to the ConnectionPool of its backend,
+        the copies from or to that filesystem use a leased connection of
+        the pool instead, so it can be used by many workers even if it is
+        not thread safe
+    """
+
+    def __init__(self, num_workers=4, chunk_size=CHUNK_SIZE, adaptive=False,
+                 schedule=fifo, rate=None, worker_rate=None, resume=False,
+                 resume_min_size=RESUME_MIN_SIZE, pump=None, pools=None):
+        super(Copier, self).__init__(num_workers)
+        self.chunk_size = chunk_size
+        if adaptive is True:
+            adaptive = ChunkSizer(chunk_size)
+        self.sizer = adaptive or None
+        self.schedule = schedule or fifo
+        self.pending = []
+        self._rate = rate
+        self._worker_rate = worker_rate
+        self.resume = resume
+        self.resume_min_size = resume_min_size
+        self.pump = pump
+        self.pools = pools or {}
+        self._buckets = {}
+        self._worker_buckets = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _bucket(self, dst_fs):
+        """TokenBucket of the destination"""
+        # any object with consume is a shared bucket
+        if hasattr(self._rate, 'consume'):
+            return self._rate
+        dst_fs = fs_inner(dst_fs)
+        with self._lock:
+            bucket = self._buckets.get(dst_fs)
+            if bucket is None:
+                bucket = self._buckets[dst_fs] = TokenBucket(self._rate)
+        return bucket
+
+    def _worker_bucket(self):
+        """TokenBucket of the current worker, None without worker_rate"""
+        if not self._worker_rate:
+            return None
+        bucket = getattr(self._local, 'bucket', None)
+        if bucket is None:
+            bucket = self._local.bucket = TokenBucket(self._worker_rate)
+            with self._lock:
+                self._worker_buckets.append(bucket)
+        return bucket
+
+    def set_rate(self, rate, dst_fs=None):
+        """Change the bandwidth limit of dst_fs, or of all the destinations,
+        while the copies are running. None or 0 removes the limit"""
+        if dst_fs is not None:
+            self._bucket(dst_fs).set_rate(rate)
+            return
+        if hasattr(self._rate, 'consume'):
+            self._rate.set_rate(rate)
+            return
+        with self._lock:
+            self._rate = rate
+            buckets = list(self._buckets.values())
+        for bucket in buckets:
+            bucket.set_rate(rate)
 
-    def copy(self, src_fs, src_path, dst_fs, dst_path, callback, inject_fs=False):
+    def set_worker_rate(self, rate):
+        """Change the bandwidth limit of each worker"""
+        with self._lock:
+            self._worker_rate = rate
+            buckets = list(self._worker_buckets)
+        for bucket in buckets:
+            bucket.set_rate(rate)
+
+    def copy(self, src_fs, src_path, dst_fs, dst_path, callback=None, inject_fs=False,
+             size=None):
         """Copy a file from on fs to another.
-            callback reciev a CountCallback object."""
-        src_file = src_fs.openbin(src_path, 'r')
-        size = src_fs.getinfo(src_path, namespaces=['details']).size
-        callbc = CountCallback(size, src_path, dst_path,  callback)
+            callback reciev a CountCallback object.
+            size of the file if known, saves a getinfo."""
+        if size is None:
+            size = src_fs.getinfo(src_path, namespaces=['details']).size
+        bucket = self._bucket(dst_fs)
+        callbc = CountCallback(size, src_path, dst_path,  callback, bucket)
         if inject_fs:
             callbc.src_fs = src_fs
             callbc.dst_fs = dst_fs
-        try:
-            dst_file = dst_fs.openbin(dst_path, 'w')
-        except Exception as e:
-            # If dst file fails to open, explicitly close src_file
-            src_file.close()
-            print(e)
-            raise
-        task = _CopyTask(src_file, dst_file, callbc)
-        if self.num_workers:
-            self.queue.put(task)
+        # both sides in the OS, the kernel copy the data
+        zero_copy = _local(src_fs, src_path) and _local(dst_fs, dst_path)
+        task = _CopyTask(src_fs, src_path, dst_fs, dst_path, size, callbc, zero_copy,
+                         self.chunk_size, self.sizer, (fs_kind(src_fs), fs_kind(dst_fs)),
+                         (bucket, self._worker_bucket),
+                         self.resume and size >= self.resume_min_size,
+                         (self.pools.get(src_fs), self.pools.get(dst_fs)))
+        if not self.num_workers:
+            task()
+        elif self.schedule is fifo:
+            self._put(task)
         else:
-            task()
\ No newline at end of file
+            self.pending.append(task)
+
+    def _put(self, task):
+        if self.pump is None:
+            self.queue.put(task)
+            return
+        while True:
+            try:
+                self.queue.put(task, timeout=0.05)
+                return
+            except Full:
+                self.pump()
+
+    def flush(self):
+        """Queue the pending copies in the order of the policy"""
+        tasks = self.schedule(self.pending)
+        self.pending = []
+        for task in tasks:
+            self._put(task)
+
+    def stop(self):
+        if self.running and self.num_workers:
+            self.flush()
+            if self.pump is not None:
+                for worker in self.workers:
+                    self._put(None)
+                for worker in self.workers:
+                    while worker.is_alive():
+                        worker.join(0.05)
+                        self.pump()
+                self.running = False
+        super(Copier, self).stop()
+        if self.pump is not None:
+            self.pump()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # an error or a ctrl-c, only the copies in flight are finished
+            self.pending = []
+        self.stop()
+        # the errors of the workers (files that couldn't be opened), only
+        # if other exception is not on the way
+        if exc_type is None and self.errors:
+            raise BulkCopyFailed(self.errors)
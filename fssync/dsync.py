@@ -1,21 +1,35 @@
 import abc
+import asyncio
 import os
 import sys
 import json
 import hashlib
+import threading
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import fs
 from fs.base import FS
 from fs.memoryfs import MemoryFS
 from fs.wrap import read_only, cache_directory
-from fs.path import join, splitext
-from copier import Copier
-from fs.errors import BulkCopyFailed, DirectoryExpected
+from fs.path import join, splitext, basename
+from .copier import Copier, CHUNK_SIZE, largest_first, CallbackPump, fs_kind
+from .copier import ConnectionPool
+from fs.errors import BulkCopyFailed
 from fs.tools import is_thread_safe
 from .utils import parse_serie_guessit as parse
 from .utils import rename
-from .utils import temp_format, subs_formats, temp_gap
-from .utils import editDistance
+from .utils import temp_format, subs_formats, video_formats, temp_gap
+from .utils import preload, parse_many, rename_many, parse_cache
 from .parser_serie import transform
+from .hashcache import HashCache
+from .index import EpisodeIndex, TitleIndex
+from .plan import SyncPlan, execute_plan, COPY, RENAME_COPY, SKIP
+from .plan import OVERWRITE as OP_OVERWRITE
+from .layout import Layout
+from .aio import execute_plan_async
+from .progress import SyncProgress
+from .stats import SyncStats, InstrumentedFS
 
 MOVIE = 0
 ANIME = 1
@@ -23,68 +37,575 @@ PSERIE = 2
 
 BLOCKSIZE = 65536
 
+# sampled comparison, head + tail + SAMPLE_WINDOWS windows in the middle
+SAMPLE_SIZE = 65536
+SAMPLE_WINDOWS = 4
+# in fast-equality mode videos bigger than this are trusted by size + samples
+FAST_EQUALITY_SIZE = 64 * 1024 * 1024
+# blocks read ahead of the hasher in concurrent hashing
+READ_AHEAD = 16
+
 RENAME = 0
 OVERWRITE = 1
 
+# max number of names sent together to a parser process
+PARSE_BATCH = 512
+
+
+def _read_exact(afile, size):
+    """Read size bytes, network files can return less than asked"""
+    buf = afile.read(size)
+    if len(buf) == size or not buf:
+        return buf
+    parts = [buf]
+    missing = size - len(buf)
+    while missing:
+        buf = afile.read(missing)
+        if not buf:
+            break
+        parts.append(buf)
+        missing -= len(buf)
+    return b''.join(parts)
+
+
+def _digest(afile, algorithm='sha1', blocksize=BLOCKSIZE):
+    hasher = hashlib.new(algorithm)
+    buf = afile.read(blocksize)
+    while buf:
+        hasher.update(buf)
+        buf = afile.read(blocksize)
+    return hasher.hexdigest()
+
 
-def hash_file(fsi, filename, algorithm='sha1'):
+def hash_file(fsi, filename, algorithm='sha1', cache=None, info=None,
+              blocksize=BLOCKSIZE):
     """
     Basic hash for a file
     :param filename: file path
     :param algorithm: see hashlib.algorithms_available
+    :param cache: optional HashCache, unchanged files are not read again
+    :param info: optional Info of the file with the details namespace
+    :param blocksize: bytes read at a time
     :return: hex hash
     """
-    hasher = getattr(hashlib, algorithm)()
+    if cache is not None:
+        digest = cache.get(fsi, filename, algorithm, info)
+        if digest is not None:
+            return digest
     with fsi.openbin(filename, 'rb') as afile:
-        buf = afile.read(BLOCKSIZE)
-        while buf:
+        digest = _digest(afile, algorithm, blocksize)
+    if cache is not None:
+        cache.put(fsi, filename, digest, algorithm, info)
+    return digest
+
+
+def hash_files(fsi1, filename1, fsi2, filename2, algorithm='sha1',
+               blocksize=BLOCKSIZE):
+    """
+    Compare the content of two files block by block
+    :param filename1: file path in fsi1
+    :param filename2: file path in fsi2
+    :param algorithm: kept for compatibility, blocks are compared directly
+    :param blocksize: bytes compared at a time
+    :return: True if the files are equal
+    """
+    with fsi1.openbin(filename1, 'rb') as afile1:
+        with fsi2.openbin(filename2, 'rb') as afile2:
+            buf1 = _read_exact(afile1, blocksize)
+            buf2 = _read_exact(afile2, blocksize)
+            while buf1 and buf2:
+                if buf1 != buf2:
+                    return False
+                buf1 = _read_exact(afile1, blocksize)
+                buf2 = _read_exact(afile2, blocksize)
+            return buf1 == buf2
+
+
+def _read_ahead(afile, blocks, stop, blocksize=BLOCKSIZE):
+    """Producer of the concurrent hashing, None marks the end of the file
+    and an exception of the reads is queued for the consumer to raise"""
+    buf = b' '
+    while buf:
+        try:
+            buf = _read_exact(afile, blocksize)
+        except Exception as e:
+            buf = e
+        while True:
+            if stop.is_set():
+                return
+            try:
+                blocks.put(buf or None, timeout=0.1)
+                break
+            except Full:
+                continue
+        if isinstance(buf, Exception):
+            return
+
+
+def _stream_file_digest(afile, algorithm='sha1', read_ahead=READ_AHEAD,
+                        blocksize=BLOCKSIZE):
+    """Digest of an open file, one thread reads while the caller hashes.
+    hashlib releases the GIL on big buffers, so reads and digests overlap."""
+    hasher = hashlib.new(algorithm)
+    blocks = Queue(maxsize=read_ahead)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_ahead,
+                              args=(afile, blocks, stop, blocksize))
+    reader.daemon = True
+    reader.start()
+    try:
+        buf = blocks.get()
+        while buf is not None:
+            if isinstance(buf, Exception):
+                raise buf
             hasher.update(buf)
-            buf = afile.read(BLOCKSIZE)
-        afile.close()
+            buf = blocks.get()
+    finally:
+        stop.set()
+        reader.join()
     return hasher.hexdigest()
 
 
-def hash_files(fsi1, filename1, fsi2, filename2, algorithm='sha1'):
+def hash_files_concurrent(fsi1, filename1, fsi2, filename2, algorithm='sha1',
+                          read_ahead=READ_AHEAD, blocksize=BLOCKSIZE):
     """
-    Basic hash for a file
-    :param filename: file path
+    Hash two files at the same time, each one in its own threads, so the
+    latency of the source and the destination overlap
     :param algorithm: see hashlib.algorithms_available
-    :return: hex hash
+    :param read_ahead: max number of blocks read and not hashed yet per file
+    :param blocksize: bytes of each block
+    :return: tuple with the hex hash of both files
+    """
+    # the files are opened in this thread, it can hold the locks of the
+    # filesystems (MemoryFS) that the threads would wait for
+    with fsi1.openbin(filename1, 'rb') as afile1, fsi2.openbin(filename2, 'rb') as afile2:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            f1 = pool.submit(_stream_file_digest, afile1, algorithm, read_ahead,
+                             blocksize)
+            f2 = pool.submit(_stream_file_digest, afile2, algorithm, read_ahead,
+                             blocksize)
+            return f1.result(), f2.result()
+
+
+def sample_offsets(size, sample=SAMPLE_SIZE, windows=SAMPLE_WINDOWS):
+    """Offsets of the head, tail and strided middle windows of a file.
+    Return an empty list when the file is too small to be worth sampling."""
+    if size <= sample*(windows+2):
+        return []
+    stride = (size - sample)//(windows+1)
+    return [0] + [stride*i for i in range(1, windows+1)] + [size - sample]
+
+
+def sample_files(fsi1, filename1, fsi2, filename2, size, sample=SAMPLE_SIZE,
+                 windows=SAMPLE_WINDOWS):
+    """
+    Compare only a few windows of two files of the same size
+    :return: False if some window differ, True if all are equal or the
+        files can't be sampled
     """
-    hasher1 = getattr(hashlib, algorithm)()
-    hasher2 = getattr(hashlib, algorithm)()
+    offsets = sample_offsets(size, sample, windows)
+    if not offsets:
+        return True
     with fsi1.openbin(filename1, 'rb') as afile1:
         with fsi2.openbin(filename2, 'rb') as afile2:
-            buf1 = afile1.read(BLOCKSIZE)
-            buf2 = afile2.read(BLOCKSIZE)
-            while buf1 and buf2:
-                hasher1.update(buf1)
-                hasher2.update(buf2)
-                if hasher1.digest() != hasher2.digest():
+            if not(afile1.seekable() and afile2.seekable()):
+                return True
+            for off in offsets:
+                afile1.seek(off)
+                afile2.seek(off)
+                if _read_exact(afile1, sample) != _read_exact(afile2, sample):
                     return False
-                buf1 = afile1.read(BLOCKSIZE)
-                buf2 = afile2.read(BLOCKSIZE)
-            afile1.close()
-            afile2.close()
     return True
 
 
+def files_equal(fsi1, filename1, fsi2, filename2, size=None, fast=False,
+                cache=None, info1=None, info2=None, algorithm='sha1',
+                concurrent=False, blocksize=BLOCKSIZE):
+    """
+    Tiered equality check of two files with the same size.
+    1. digests in cache, 2. sampled windows, 3. full comparison.
+    :param size: size of the files, enables the sampled comparison
+    :param fast: trust size plus samples for videos bigger than FAST_EQUALITY_SIZE
+    :param cache: optional HashCache
+    :param algorithm: see hashlib.algorithms_available
+    :param concurrent: hash both files at the same time in separate threads
+    :param blocksize: bytes read at a time by the full comparison
+    :return: True if the files are (considered) equal
+    """
+    h1 = h2 = None
+    if cache is not None:
+        h1 = cache.get(fsi1, filename1, algorithm, info1)
+        h2 = cache.get(fsi2, filename2, algorithm, info2)
+        if h1 is not None and h2 is not None:
+            return h1 == h2
+    if size is not None:
+        if not sample_files(fsi1, filename1, fsi2, filename2, size):
+            return False
+        if fast and size >= FAST_EQUALITY_SIZE and \
+                splitext(filename1)[1].lower() in video_formats:
+            return True
+    if concurrent and h1 is None and h2 is None:
+        h1, h2 = hash_files_concurrent(fsi1, filename1, fsi2, filename2, algorithm,
+                                       blocksize=blocksize)
+        if cache is not None:
+            cache.put(fsi1, filename1, h1, algorithm, info1)
+            cache.put(fsi2, filename2, h2, algorithm, info2)
+        return h1 == h2
+    if cache is None:
+        return hash_files(fsi1, filename1, fsi2, filename2, algorithm, blocksize)
+    if h1 is None:
+        with fsi1.openbin(filename1, 'rb') as afile:
+            h1 = _digest(afile, algorithm, blocksize)
+        cache.put(fsi1, filename1, h1, algorithm, info1)
+    if h2 is None:
+        with fsi2.openbin(filename2, 'rb') as afile:
+            h2 = _digest(afile, algorithm, blocksize)
+        cache.put(fsi2, filename2, h2, algorithm, info2)
+    return h1 == h2
+
+
 class BadClassError(Exception):
     pass
 
 
 class DSync(metaclass=abc.ABCMeta):
-    def __init__(self, source, dest):
+    _parser_kind = 'rename'
+
+    def __init__(self, source, dest, hash_cache=None, fast_equal=False,
+                 hash_algorithm='sha1', concurrent_hash=False, parse_workers=0,
+                 hash_blocksize=BLOCKSIZE, chunk_size=CHUNK_SIZE, adaptive_chunks=False,
+                 schedule=largest_first, bandwidth=None, resume=False, stats=None,
+                 source_pool=None, dest_pool=None, parse_db=None):
         if not issubclass(source.__class__, FS):
             raise BadClassError('source must be direct/indirect subclass of FS')
         if not issubclass(dest.__class__, FS):
             raise BadClassError('dest must be direct/indirect subclass of FS')
+        if hash_cache is not None and not isinstance(hash_cache, HashCache):
+            raise BadClassError('hash_cache must be a HashCache instance')
+        # True or a SyncStats records timings and calls of the filesystems
+        if stats is True:
+            stats = SyncStats()
+        self._stats = stats or None
+        self._raw_dest = dest
+        if self._stats is not None:
+            source = InstrumentedFS(source, self._stats, 'source:'+fs_kind(source))
+            dest = InstrumentedFS(dest, self._stats, 'dest:'+fs_kind(dest))
         self._source = cache_directory(read_only(source))
         self._dest = dest
+        self._hash_cache = hash_cache
+        self._fast_equal = fast_equal
+        self._hash_algorithm = hash_algorithm
+        self._concurrent_hash = concurrent_hash
+        self._parse_workers = parse_workers
+        self._hash_blocksize = hash_blocksize
+        self._chunk_size = chunk_size
+        # True or a ChunkSizer, see Copier
+        self._adaptive_chunks = adaptive_chunks
+        # order of the copies, see the policies of copier
+        self._schedule = schedule
+        # bytes/s to the destination or a TokenBucket
+        self._bandwidth = bandwidth
+        self._copier = None
+        # resumable copies of the big files, see Copier
+        self._resume = resume
+        # ConnectionPools of the backends that are not thread safe, the
+        # copies run in parallel with a connection each
+        self._source_pool = source_pool
+        self._dest_pool = dest_pool
+        # sqlite file that keeps the parsed names between runs, see ParseCache
+        self._parse_db = parse_db
+        if parse_db is not None:
+            parse_cache.open(parse_db)
+
+    def _same_file(self, src_path, dst_path, src_info=None, dst_info=None):
+        """Compare the content of src_path in source with dst_path in dest.
+        With a hash cache the digests of unchanged files are not computed again,
+        and files with different sampled windows are never read completely."""
+        size = src_info.size if src_info is not None else None
+        stats = self._stats
+        if stats is not None:
+            read = stats.bytes_read(self._source_backend) + stats.bytes_read(self._dest_backend)
+        with self._phase('hash'):
+            res = files_equal(self._source, src_path, self._dest, dst_path, size,
+                              fast=self._fast_equal, cache=self._hash_cache,
+                              info1=src_info, info2=dst_info,
+                              algorithm=self._hash_algorithm,
+                              concurrent=self._concurrent_hash,
+                              blocksize=self._hash_blocksize)
+        if stats is not None:
+            stats.add_hashed(stats.bytes_read(self._source_backend) +
+                             stats.bytes_read(self._dest_backend) - read)
+        return res
+
+    @property
+    def _source_backend(self):
+        return 'source:'+fs_kind(self._source)
+
+    @property
+    def _dest_backend(self):
+        return 'dest:'+fs_kind(self._dest)
+
+    @contextmanager
+    def _phase(self, name):
+        """Time the block as the phase name when the stats are enabled"""
+        if self._stats is None:
+            yield
+        else:
+            with self._stats.phase(name):
+                yield
+
+    @property
+    def stats(self):
+        """SyncStats of the runs, None if not enabled"""
+        return self._stats
+
+    def _finish_stats(self):
+        # end of a run, the new parsed names and the hash hits are saved
+        parse_cache.flush()
+        if self._hash_cache is not None:
+            self._hash_cache.flush()
+        if self._stats is None:
+            return None
+        return self._stats.finish(self._hash_cache)
+
+    def _parse(self, name):
+        """Parse a file name into a CapData"""
+        return rename(name)
+
+    def _walk(self, ff):
+        """Walk ff, with parse_workers the names of each directory are parsed
+        in a process pool before the (serial) classification.
+        parse_workers None uses all the cpus, 0 parse in this process.
+        :return: the walk and the dict of parsed names (or None) for
+            parse_many/rename_many"""
+        if self._parse_workers == 0 and self._stats is None:
+            return ff.walk(namespaces=['details']), None
+        with self._phase('walk'):
+            walk = list(ff.walk(namespaces=['details']))
+        if self._parse_workers == 0:
+            return walk, None
+        batches = []
+        for path, dirs, files in walk:
+            names = [j.name for j in files]
+            for i in range(0, len(names), PARSE_BATCH):
+                batches.append(names[i:i+PARSE_BATCH])
+        with self._phase('parse'):
+            parsed = preload(self._parser_kind, batches, self._parse_workers)
+        return walk, parsed
+
+    def _target(self, path, fil, pp):
+        """Path in the destination for the file fil of the folder path"""
+        return join(path, fil)
+
+    def _direct(self, pp):
+        """True for the files that are copied without searching the same episode"""
+        return pp.ext in subs_formats
+
+    def _free_name(self, index, name):
+        nn, ext = splitext(name)
+        num = 2
+        temp = nn+'_rename_'+str(num)+ext
+        while temp in index:
+            num += 1
+            temp = nn+'_rename_'+str(num)+ext
+        return temp
+
+    def _plan_file(self, plan, index, planned, path, entry, use_hash, collition):
+        sc = self._source
+        pp = entry.meta
+        opth = entry.source
+        path2 = self._target(path, entry.name, pp)
+        # if exist the file with the exactly transform name
+        if basename(path2) in index:
+            name = basename(path2)
+        elif self._direct(pp):
+            name = None
+        # if we have the chapter number search a file with similar name and same chapter
+        elif pp.episode:
+            name = index.find(pp.title, pp.episode)
+        else:
+            name = None
+        if not name:
+            planned[path2] = plan.add(COPY, opth, path2, entry.size, reason='new')
+            index.add(basename(path2))
+            return
+        dst = join(path, name)
+        # the walk already got the size and mtime of the source file
+        i1 = entry
+        if i1.size is None:
+            i1 = sc.getinfo(opth, namespaces=['details'])
+        if dst in planned:
+            # two source files for the same destination, keep the bigger
+            op = planned[dst]
+            if i1.size > op.size:
+                plan.add(SKIP, op.src, dst, op.size, reason='replaced by '+opth)
+                op.src, op.size = opth, i1.size
+            else:
+                plan.add(SKIP, opth, dst, i1.size, reason='smaller than '+op.src)
+            return
+        i2 = index.getinfo(name)
+        if i1.size < i2.size:
+            ## if the size of new is less than older du nothing
+            plan.add(SKIP, opth, dst, i1.size, reason='smaller')
+            return
+        if i1.size > i2.size:
+            planned[dst] = plan.add(OP_OVERWRITE, opth, dst, i1.size, reason='bigger')
+            return
+        ## if has the same size and hash is avaliable compare the hash
+        if use_hash and self._same_file(opth, dst, i1, i2):
+            ## if the has coincide are the same file 99.9%
+            plan.add(SKIP, opth, dst, i1.size, reason='same content')
+            return
+        # if size are equal but hash are different (or not used) we have a collition
+        if collition == RENAME:
+            temp = self._free_name(index, name)
+            index.move(name, temp)
+            index.add(name)
+            planned[dst] = plan.add(RENAME_COPY, opth, dst, i1.size,
+                                    rename_to=join(path, temp), reason='collition')
+        else:
+            planned[dst] = plan.add(OP_OVERWRITE, opth, dst, i1.size, reason='collition')
+
+    def plan(self, use_hash=True, collition=OVERWRITE):
+        """Decide what the sync will do without modifying the destination.
+        :return: SyncPlan"""
+        with self._phase('plan'):
+            plan = self._plan(use_hash, collition)
+        parse_cache.flush()
+        return plan
+
+    def _plan(self, use_hash, collition):
+        sc = self._source
+        layout = self._make_temp_fs(sc)
+        ff = self._dest
+        plan = SyncPlan()
+        with sc.lock(), ff.lock():
+            # iterate over the layout (only folders un the 1st level)
+            for fold in layout.folders():
+                path = join('/', fold)
+                if ff.exists(path):
+                    with self._phase('index'):
+                        index = EpisodeIndex.from_folder(ff, path, self._parse)
+                else:
+                    plan.makedir(path)
+                    index = EpisodeIndex(ff, path, self._parse)
+                planned = {}
+                # iterate over files in each folder
+                for entry in layout.files(fold):
+                    self._plan_file(plan, index, planned, path, entry,
+                                    use_hash, collition)
+        return plan
+
+    def _parallel(self):
+        """True if the copies can run in many threads, the filesystems
+        that are not thread safe need a ConnectionPool"""
+        return all(pool is not None or is_thread_safe(fsi)
+                   for fsi, pool in ((self._source, self._source_pool),
+                                     (self._dest, self._dest_pool)))
+
+    def _make_copier(self, workers, pump=None):
+        pools = {}
+        if self._source_pool is not None:
+            pools[self._source] = self._source_pool
+        if self._dest_pool is not None:
+            pools[self._dest] = self._dest_pool
+        return Copier(num_workers=workers,
+                      pump=pump,
+                      chunk_size=self._chunk_size,
+                      adaptive=self._adaptive_chunks,
+                      schedule=self._schedule,
+                      rate=self._bandwidth,
+                      resume=self._resume,
+                      pools=pools)
+
+    def execute(self, plan, workers=1, callback=None):
+        """Run a SyncPlan, callback reciev a CountCallback object
+        or is a SyncProgress that aggregates all the copies.
+        A CallbackPump as callback runs in this thread."""
+        assert workers >= 0
+        if isinstance(callback, SyncProgress):
+            callback.start(plan)
+        sc = self._source
+        ff = self._dest
+        pump = callback.pump if isinstance(callback, CallbackPump) else None
+        if self._stats is not None:
+            callback = self._count_copied(callback)
+        try:
+            with self._phase('copy'):
+                with sc.lock(), ff.lock():
+                    _thread_safe = self._parallel()
+                # the workers open the files, they can't wait for the locks
+                # of the filesystems held by this thread
+                with self._make_copier(workers if _thread_safe else 0, pump) as copier:
+                    self._copier = copier
+                    try:
+                        execute_plan(plan, sc, ff, copier, callback)
+                    finally:
+                        self._copier = None
+        except BulkCopyFailed as e:
+            raise BulkCopyFailed(e.errors) ## do somthing with error late, for now just raise again
 
-    @abc.abstractmethod
-    def sync(self, workers, use_hash, collition):
-        raise NotImplementedError
+    def _count_copied(self, callback):
+        stats = self._stats
+
+        def counted(count_callback):
+            stats.copied(count_callback)
+            if callback is not None:
+                callback(count_callback)
+        return counted
+
+    def set_bandwidth(self, rate):
+        """Change the bandwidth limit (bytes/s, None unlimited), also
+        of a sync that is running in other thread"""
+        if hasattr(self._bandwidth, 'consume'):
+            self._bandwidth.set_rate(rate)
+            return
+        self._bandwidth = rate
+        copier = self._copier
+        if copier is not None:
+            copier.set_rate(rate)
+
+    def sync(self, workers=1, use_hash=True, collition=OVERWRITE, progress=None):
+        """progress is an optional SyncProgress.
+        Return the SyncStats if enabled"""
+        assert workers >= 0
+        self.execute(self.plan(use_hash, collition), workers, progress)
+        return self._finish_stats()
+
+    def sync_callback(self, callback, use_hash=True, collition=OVERWRITE, workers=1):
+        """sync with workers, callback is always called in this thread
+        with the CountCallback of a copy (or is a SyncProgress)"""
+        assert workers >= 0
+        plan = self.plan(use_hash, collition)
+        if isinstance(callback, SyncProgress):
+            callback.start(plan)
+        self.execute(plan, workers, CallbackPump(callback))
+        return self._finish_stats()
+
+    async def sync_async(self, workers=1, use_hash=True, collition=OVERWRITE,
+                         callback=None, progress=None, executor=None, semaphore=None):
+        """sync from a coroutine, the plan and the copies run in executor
+        (see aio.execute_plan_async), the event loop is never blocked.
+        progress is an aio.Progress to iterate the events of the copies."""
+        assert workers >= 0
+        loop = asyncio.get_running_loop()
+        plan = await loop.run_in_executor(executor, self.plan, use_hash, collition)
+        if isinstance(callback, SyncProgress):
+            callback.start(plan)
+        if self._stats is not None:
+            callback = self._count_copied(callback)
+        if not self._parallel():
+            workers = 1
+        copier = self._make_copier(0)
+        self._copier = copier
+        try:
+            with self._phase('copy'):
+                await execute_plan_async(plan, self._source, self._dest, copier,
+                                         max(workers, 1), callback, progress,
+                                         executor, semaphore)
+        finally:
+            self._copier = None
+        return self._finish_stats()
 
     @abc.abstractmethod
     def organize(self):
@@ -96,109 +617,105 @@ class DSync(metaclass=abc.ABCMeta):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._source.close()
         self._dest.close()
+        self._raw_dest.close()
+        for pool in (self._source_pool, self._dest_pool):
+            if pool is not None:
+                pool.close()
+        if self._parse_db is not None:
+            parse_cache.close()
 
 
 class Movies(DSync):
 
-    def __init__(self, source, dest):
-        super(Movies, self).__init__(source, dest)
+    def __init__(self, source, dest, **kwargs):
+        super(Movies, self).__init__(source, dest, **kwargs)
 
-    def sync(self, workers=1, use_hash=True, collition=OVERWRITE):
-        assert workers >= 0
+    def plan(self, use_hash=True, collition=OVERWRITE):
+        return SyncPlan()
 
     def organize(self):
-        pass
+        return self._finish_stats()
 
 
 class SeriesAnimes(DSync):
 
-    def __init__(self, source, dest, rename=False):
-        super(SeriesAnimes, self).__init__(source, dest)
+    def __init__(self, source, dest, rename=False, **kwargs):
+        super(SeriesAnimes, self).__init__(source, dest, **kwargs)
         self._rename = rename
 
+    def _target(self, path, fil, pp):
+        if pp.episode:
+            fill = transform(pp.title)+' - '+str(pp.episode)
+        else:
+            fill = transform(pp.title)
+        if pp.episode_title:
+            fill = fill + ' - ' + str(pp.episode_title)
+        fill += pp.ext
+        return join(path, fill)
+
     def _make_temp_fs(self, ff):
-        # make virtual filesystem in ram with the final
-        # organization of the filesystem
-        ram = MemoryFS()
+        # make the final organization of the filesystem
+        # (layout.to_memoryfs().tree() for see it in pretty format)
+        layout = Layout()
 
-        for path, dirs, files in ff.walk():
+        walk, parsed = self._walk(ff)
+        for path, dirs, files in walk:
             posprocsub = []
             fils = set()
-            for j in files:
-                # if splitext(j.name)[1] in subs_formats and path!="/":
-                if splitext(j.name)[1] in subs_formats:
-                    posprocsub.append(j.name)
-                    continue
-                pp = rename(j.name)
-                try:
-                    if pp.is_video:
-                        fold = transform(pp.title)
-                        pth = join('/',fold)
-                        if not ram.exists(pth):
-                            ram.makedir(fold)
-                        fils.add(fold)
-                        ram.writetext(join(pth,j.name),join(path,j.name))
-                except KeyError:
+            titles = None
+            with self._phase('parse'):
+                table = rename_many([j.name for j in files], parsed)
+            for k, j in enumerate(files):
+                # if table.exts[k] in subs_formats and path!="/":
+                if table.exts[k] in subs_formats:
+                    posprocsub.append(k)
                     continue
-
-            for j in posprocsub:
-                pp = rename(j)
+                if table.is_video[k]:
+                    fold = transform(table.titles[k])
+                    fils.add(fold)
+                    layout.add(fold, j.name, join(path, j.name), table.data[k], j)
+
+            for k in posprocsub:
+                j = files[k]
+                pp = table.data[k]
                 fold = transform(pp.title)
-                pth = join('/',fold)
-                if ram.exists(pth):
-                    ram.writetext(join(pth,j),join(path,j))
+                if fold in layout:
+                    layout.add(fold, j.name, join(path, j.name), pp, j)
                 elif len(fils)==1:
-                    pth = join('/',list(fils)[0])
-                    ram.writetext(join(pth,j),join(path,j))
+                    layout.add(list(fils)[0], j.name, join(path, j.name), pp, j)
                 elif len(fils)>1:
-                    best = None
-                    gap = 3
-                    for i in fils:
-                        n = editDistance(i,foldd, True)
-                        if n < 3 and n < gap:
-                            best=i
-                            gap=n
-                        elif n == 0:
-                            best = i
-                            break
+                    if titles is None:
+                        titles = TitleIndex(fils, lower=True)
+                    found = titles.nearest(fold, 3)
+                    best = found[1] if found else None
                     if best:
-                        pth = join('/',best)
-                        ram.writetext(join(pth,j),join(path,j))
+                        layout.add(best, j.name, join(path, j.name), pp, j)
                     else:
-                        if not(ram.exists('/subs')):
-                            ram.makedir('/subs')
-                        ram.writetext(join('/subs',j),join(path,j))
+                        layout.add('subs', j.name, join(path, j.name), pp, j)
                 else:
-                    if not(ram.exists('/subs')):
-                        ram.makedir('/subs')
-                    ram.writetext(join('/subs',j),join(path,j))
-        return ram
+                    layout.add('subs', j.name, join(path, j.name), pp, j)
+        return layout
 
     def organize(self):
         """Reorganize the folder, put each chapter of the same serie
         and season in the same folder, including subtitle"""
+        with self._phase('organize'):
+            self._organize()
+        return self._finish_stats()
+
+    def _organize(self):
         ff = self._dest
-        ram = self._make_temp_fs(ff)
+        layout = self._make_temp_fs(ff)
 
-        # execute ram.tree() for see the structure in pretty format
-        # reorganize the filesystem from the structure in the
-        # virtualfilesistem in ram
-        data = set(ram.listdir('/'))
+        # reorganize the filesystem from the layout
+        data = set(layout.folders())
         for fold in data:
             path = join('/',fold)
             if not(ff.exists(path)):
                 ff.makedir(path)
-            for fil in ram.listdir(path):
-                pp = rename(fil)
-                if pp.episode:
-                    fill = transform(pp.title)+' - '+str(pp.episode)
-                else:
-                    fill = transform(pp.title)
-                if pp.episode_title:
-                    fill = fill+' - '+str(pp.episode_title)
-                fill += pp.ext
-                path2 = join(path, fill)
-                opth = ram.readtext(join(path, fil))
+            for entry in layout.files(fold):
+                path2 = self._target(path, entry.name, entry.meta)
+                opth = entry.source
                 if path2 == opth:
                     continue
                 ff.move(opth, path2)
@@ -211,436 +728,126 @@ class SeriesAnimes(DSync):
                 else:
                     ff.removetree(join('/',i.name))
 
-    def sync(self, workers=1, use_hash=True, collition=OVERWRITE):
-        assert workers >= 0
-        sc = self._source
-        ram = self._make_temp_fs(sc)
-        ff = self._dest
-        # execute ram.tree() for see the structure in pretty format
-        # reorganize the filesystem from the structure in the
-        # virtualfilesistem in ram
-        try:
-            data = set(ram.listdir('/'))
-            with sc.lock(), ff.lock():
-                _thread_safe = is_thread_safe(sc, ff)
-                with Copier(num_workers=workers if _thread_safe else 0) as copier:
-                    # iterate over the virtual structure( only folders un the 1st level)
-                    for fold in data:
-                        path = join('/', fold)
-                        if not(ff.exists(path)):
-                            ff.makedir(path)
-                        # iterate over files in each folder
-                        try:
-                            lsd = ram.listdir(path)
-                        except DirectoryExpected:
-                            copier.copy(sc, path, ff, path)
-                        for fil in lsd:
-                            pp = rename(fil)
-                            if pp.episode:
-                                fill = transform(pp.title)+' - '+str(pp.episode)
-                                fillt = fill
-                            else:
-                                fill = transform(pp.title)
-                                fillt = fill
-                            if pp.episode_title:
-                                fill = fill + ' - ' + str(pp.episode_title)
-                            fill += pp.ext
-                            path2 = join(path, fill)
-                            opth = ram.readtext(join(path, fil))
-                            # if exist the file with the exactly transform name
-                            if ff.exists(path2):
-                                i1 = sc.getinfo(opth, namespaces=['details'])
-                                i2 = ff.getinfo(path2, namespaces=['details'])
-                                if i1.size < i2.size:
-                                    ## if the size of new is less than older du nothing
-                                    continue
-                                elif use_hash and i1.size == i2.size:
-                                    ## if has the same size and hash is avaliable compare the hash
-                                    # h1 = hash_file(sc, opth)
-                                    # h2 = hash_file(ff, path2)
-                                    if hash_files(sc, opth, ff, path2):
-                                        ## if the has coincide are the same file 99.9%
-                                        continue
-                                    # if size are equal but hash are different we have a collition
-                                    if collition == OVERWRITE:
-                                        copier.copy(sc, opth, ff, path2)
-                                    if collition == RENAME:
-                                        nn, ext = splitext(path2)
-                                        num = 2
-                                        temppth = nn+'_rename_'+str(num)+ext
-                                        while ff.exists(temppth):
-                                            num += 1
-                                            temppth = nn+'_rename_'+str(num)+ext
-                                        ff.move(path2, temppth)
-                                        copier.copy(sc, opth, ff, path2)
-                                elif not use_hash and i1.size == i2.size:
-                                    # if size are equal but don use hash we have a collition
-                                    if collition == OVERWRITE:
-                                        copier.copy(sc, opth, ff, path2)
-                                    if collition == RENAME:
-                                        nn, ext = splitext(path2)
-                                        num = 2
-                                        temppth = nn+'_rename_'+str(num)+ext
-                                        while ff.exists(temppth):
-                                            num += 1
-                                            temppth = nn+'_rename_'+str(num)+ext
-                                        ff.move(path2, temppth)
-                                        copier.copy(sc, opth, ff, path2)
-                                else:
-                                    copier.copy(sc, opth, ff, path2)
-                            elif pp.ext in subs_formats:
-                                copier.copy(sc, opth, ff, path2)
-                            # if we have the chapter number
-                            elif pp.episode:
-                                try:
-                                    if 'x' in str(pp.episode):
-                                        my = int(str(pp.episode).split('x')[1])
-                                    elif 'X' in str(pp.episode):
-                                        my = int(str(pp.episode).split('X')[1])
-                                    else:
-                                        my = int(str(pp.episode))
-                                except:
-                                    copier.copy(sc, opth, ff, path2)
-                                    continue
-                                name = ''
-                                for filee in ff.listdir(path):
-                                    pp2 = rename(filee)
-                                    if editDistance(pp2.title, fillt) < 3:
-                                        try:
-                                            if 'x' in str(pp2.episode):
-                                                my2 = int(str(pp2.episode).split('x')[1])
-                                            elif 'X' in str(pp2.episode):
-                                                my2 = int(str(pp2.episode).split('X')[1])
-                                            else:
-                                                my2 = int(str(pp2.episode))
-                                        except:
-                                            continue
-                                        if my2 == my:
-                                            name = filee
-                                            break
-                                # if we found a file with similar name and same chapter
-                                if name:
-                                    i1 = sc.getinfo(opth, namespaces=['details'])
-                                    i2 = ff.getinfo(join(path, name), namespaces=['details'])
-                                    if i1.size < i2.size:
-                                        ## if the size of new is less than older du nothing
-                                        continue
-                                    elif use_hash and i1.size == i2.size:
-                                        ## if has the same size and hash is avaliable compare the hash
-                                        temppth = join(path, name)
-                                        # h1 = hash_file(sc, opth)
-                                        # h2 = hash_file(ff, temppth)
-                                        if hash_files(sc, opth, ff, temppth):
-                                            continue
-                                        # if size are equal but hash are different we have a collition
-                                        if collition == OVERWRITE:
-                                            copier.copy(sc, opth, ff, temppth)
-                                        if collition == RENAME:
-                                            nn, ext = splitext(temppth)
-                                            num = 2
-                                            temppth2 = nn+'_rename_'+str(num)+ext
-                                            while ff.exists(temppth2):
-                                                num += 1
-                                                temppth2 = nn+'_rename_'+str(num)+ext
-                                            ff.move(temppth, temppth2)
-                                            copier.copy(sc, opth, ff, temppth)
-                                    elif not use_hash and i1.size == i2.size:
-                                        # if size are equal but don use hash we have a collition
-                                        temppth = join(path, name)
-                                        if collition == OVERWRITE:
-                                            copier.copy(sc, opth, ff, temppth)
-                                        if collition == RENAME:
-                                            nn, ext = splitext(temppth)
-                                            num = 2
-                                            temppth2 = nn+'_rename_'+str(num)+ext
-                                            while ff.exists(temppth2):
-                                                num += 1
-                                                temppth2 = nn+'_rename_'+str(num)+ext
-                                            ff.move(temppth, temppth2)
-                                            copier.copy(sc, opth, ff, temppth)
-                                    else:
-                                        temppth = join(path, name)
-                                        copier.copy(sc, opth, ff, temppth)
-                                else:
-                                    copier.copy(sc, opth, ff, path2)
 
-        except BulkCopyFailed as e:
-            raise BulkCopyFailed(e.errors) ## do somthing with error late, for now just raise again
+class SeriesPerson(DSync):
 
-    def sync_callback(callback, use_hash=False, collition=OVERWRITE):
-        sc = self._source
-        ram = self._make_temp_fs(sc)
-        ff = self._dest
-        # execute ram.tree() for see the structure in pretty format
-        # reorganize the filesystem from the structure in the
-        # virtualfilesistem in ram
-        try:
-            data = set(ram.listdir('/'))
-            with sc.lock(), ff.lock():
-                with Copier(num_workers=1) as copier:
-                    # iterate over the virtual structure( only folders un the 1st level)
-                    for fold in data:
-                        path = join('/', fold)
-                        if not(ff.exists(path)):
-                            ff.makedir(path)
-                        # iterate over files in each folder
-                        try:
-                            lsd = ram.listdir(path)
-                        except DirectoryExpected:
-                            copier.copy(sc, path, ff, path, callback)
-                        for fil in lsd:
-                            pp = rename(fil)
-                            if pp.episode:
-                                fill = transform(pp.title)+' - '+str(pp.episode)
-                                fillt = fill
-                            else:
-                                fill = transform(pp.title)
-                                fillt = fill
-                            if pp.episode_title:
-                                fill = fill + ' - ' + str(pp.episode_title)
-                            fill += pp.ext
-                            path2 = join(path, fill)
-                            opth = ram.readtext(join(path, fil))
-                            # if exist the file with the exactly transform name
-                            if ff.exists(path2):
-                                i1 = sc.getinfo(opth, namespaces=['details'])
-                                i2 = ff.getinfo(path2, namespaces=['details'])
-                                if i1.size < i2.size:
-                                    ## if the size of new is less than older du nothing
-                                    continue
-                                elif use_hash and i1.size == i2.size:
-                                    ## if has the same size and hash is avaliable compare the hash
-                                    # h1 = hash_file(sc, opth)
-                                    # h2 = hash_file(ff, path2)
-                                    if hash_files(sc, opth, ff, path2):
-                                        ## if the has coincide are the same file 99.9%
-                                        continue
-                                    # if size are equal but hash are different we have a collition
-                                    if collition == OVERWRITE:
-                                        copier.copy(sc, opth, ff, path2, callback)
-                                    if collition == RENAME:
-                                        nn, ext = splitext(path2)
-                                        num = 2
-                                        temppth = nn+'_rename_'+str(num)+ext
-                                        while ff.exists(temppth):
-                                            num += 1
-                                            temppth = nn+'_rename_'+str(num)+ext
-                                        ff.move(path2, temppth)
-                                        copier.copy(sc, opth, ff, path2, callback)
-                                elif not use_hash and i1.size == i2.size:
-                                    # if size are equal but don use hash we have a collition
-                                    if collition == OVERWRITE:
-                                        copier.copy(sc, opth, ff, path2)
-                                    if collition == RENAME:
-                                        nn, ext = splitext(path2)
-                                        num = 2
-                                        temppth = nn+'_rename_'+str(num)+ext
-                                        while ff.exists(temppth):
-                                            num += 1
-                                            temppth = nn+'_rename_'+str(num)+ext
-                                        ff.move(path2, temppth)
-                                        copier.copy(sc, opth, ff, path2, callback)
-                                else:
-                                    copier.copy(sc, opth, ff, path2, callback)
-                            elif pp.ext in subs_formats:
-                                copier.copy(sc, opth, ff, path2, callback)
-                            # if we have the chapter number
-                            elif pp.episode:
-                                try:
-                                    if 'x' in str(pp.episode):
-                                        my = int(str(pp.episode).split('x')[1])
-                                    elif 'X' in str(pp.episode):
-                                        my = int(str(pp.episode).split('X')[1])
-                                    else:
-                                        my = int(str(pp.episode))
-                                except:
-                                    copier.copy(sc, opth, ff, path2, callback)
-                                    continue
-                                name = ''
-                                for filee in ff.listdir(path):
-                                    pp2 = rename(filee)
-                                    if editDistance(pp2.title, fillt) < 3:
-                                        try:
-                                            if 'x' in str(pp2.episode):
-                                                my2 = int(str(pp2.episode).split('x')[1])
-                                            elif 'X' in str(pp2.episode):
-                                                my2 = int(str(pp2.episode).split('X')[1])
-                                            else:
-                                                my2 = int(str(pp2.episode))
-                                        except:
-                                            continue
-                                        if my2 == my:
-                                            name = filee
-                                            break
-                                # if we found a file with similar name and same chapter
-                                if name:
-                                    i1 = sc.getinfo(opth, namespaces=['details'])
-                                    i2 = ff.getinfo(join(path, name), namespaces=['details'])
-                                    if i1.size < i2.size:
-                                        ## if the size of new is less than older du nothing
-                                        continue
-                                    elif use_hash and i1.size == i2.size:
-                                        ## if has the same size and hash is avaliable compare the hash
-                                        temppth = join(path, name)
-                                        # h1 = hash_file(sc, opth)
-                                        # h2 = hash_file(ff, temppth)
-                                        if hash_files(sc, opth, ff, temppth):
-                                            continue
-                                        # if size are equal but hash are different we have a collition
-                                        if collition == OVERWRITE:
-                                            copier.copy(sc, opth, ff, temppth, callback)
-                                        if collition == RENAME:
-                                            nn, ext = splitext(temppth)
-                                            num = 2
-                                            temppth2 = nn+'_rename_'+str(num)+ext
-                                            while ff.exists(temppth2):
-                                                num += 1
-                                                temppth2 = nn+'_rename_'+str(num)+ext
-                                            ff.move(temppth, temppth2)
-                                            copier.copy(sc, opth, ff, temppth, callback)
-                                    elif not use_hash and i1.size == i2.size:
-                                        # if size are equal but don use hash we have a collition
-                                        temppth = join(path, name)
-                                        if collition == OVERWRITE:
-                                            copier.copy(sc, opth, ff, temppth, callback)
-                                        if collition == RENAME:
-                                            nn, ext = splitext(temppth)
-                                            num = 2
-                                            temppth2 = nn+'_rename_'+str(num)+ext
-                                            while ff.exists(temppth2):
-                                                num += 1
-                                                temppth2 = nn+'_rename_'+str(num)+ext
-                                            ff.move(temppth, temppth2)
-                                            copier.copy(sc, opth, ff, temppth, callback)
-                                    else:
-                                        temppth = join(path, name)
-                                        copier.copy(sc, opth, ff, temppth, callback)
-                                else:
-                                    copier.copy(sc, opth, ff, path2, callback)
+    _parser_kind = 'guessit'
 
-        except BulkCopyFailed as e:
-            raise BulkCopyFailed(e.errors) ## do somthing with error late, for now just raise again
+    def __init__(self, source, dest, **kwargs):
+        super(SeriesPerson, self).__init__(source, dest, **kwargs)
 
+    def _parse(self, name):
+        return parse(name)
 
-class SeriesPerson(DSync):
+    def _direct(self, pp):
+        return pp.ext in subs_formats or 'image' in (pp['mimetype'] or '')
 
-    def __init__(self, source, dest):
-        super(SeriesPerson, self).__init__(source, dest)
+    @staticmethod
+    def _closest_folder(titles, title, gap):
+        """Closest folder to title in the TitleIndex of (folder, is season),
+        season folders admit distances below temp_gap, the others below gap"""
+        for n, i, v in sorted(titles.search(title, max(temp_gap, gap))):
+            if n < temp_gap*v + (1-v)*gap:
+                return i
+        return None
 
     def _make_temp_fs(self, ff):
-        ram = MemoryFS()
+        layout = Layout()
 
-        for path, dirs, files in ff.walk():
+        walk, parsed = self._walk(ff)
+        for path, dirs, files in walk:
             posprocsub = []
             posprocimg = []
             fils = set()
-            for j in files:
-                # if splitext(j.name)[1] in subs_formats and path!="/":
-                if splitext(j.name)[1] in subs_formats:
-                    posprocsub.append(j.name)
+            titles = None
+            with self._phase('parse'):
+                table = parse_many([j.name for j in files], parsed=parsed)
+            for k, j in enumerate(files):
+                # if table.exts[k] in subs_formats and path!="/":
+                if table.exts[k] in subs_formats:
+                    posprocsub.append(k)
                     continue
-                pp = parse(j.name)
-                try:
-                    if 'video' in pp['mimetype']:
-                        fold = transform(pp['title'])
-                        if pp.season:
-                            fold += ' - '+temp_format(pp['season'])
-                            fils.add((fold, 1))
-                        else:
-                            fils.add((fold, 0))
-                        pth = join('/',fold)
-                        if not ram.exists(pth):
-                            ram.makedir(fold)
-                        ram.writetext(join(pth,j.name),join(path,j.name))
-                    elif 'image' in pp['mimetype']:
-                        posprocimg.append(j.name)
-                except KeyError:
+                pp = table.data[k]
+                mime = table.mimetypes[k] or ''
+                if pp is None:
+                    continue
+                if 'video' in mime:
+                    fold = transform(pp['title'])
+                    if pp.season:
+                        fold += ' - '+temp_format(pp['season'])
+                        fils.add((fold, 1))
+                    else:
+                        fils.add((fold, 0))
+                    layout.add(fold, j.name, join(path, j.name), pp, j)
+                elif 'image' in mime:
+                    posprocimg.append(k)
+
+            for k in posprocsub:
+                j = files[k]
+                pp = table.data[k]
+                if pp is None:
                     continue
-
-            for j in posprocsub:
-                pp = parse(j)
                 foldd = transform(pp['title'])
                 if pp.season:
                     fold = foldd + ' - '+temp_format(pp['season'])
                 else:
                     fold = foldd
-                pth = join('/',fold)
-                if ram.exists(pth):
-                    ram.writetext(join(pth,j),join(path,j))
+                if fold in layout:
+                    layout.add(fold, j.name, join(path, j.name), pp, j)
                 elif len(fils)==1:
-                    pth = join('/',list(fils)[0])
-                    ram.writetext(join(pth,j),join(path,j))
+                    layout.add(list(fils)[0][0], j.name, join(path, j.name), pp, j)
                 elif len(fils)>1:
-                    best = None
-                    gap = temp_gap+10
-                    for i, v in fils:
-                        n = editDistance(i,foldd)
-                        if n < temp_gap*v + (1-v)*3 and n < gap:
-                            best=i
-                            gap=n
-                        elif n == 0:
-                            best = i
-                            break
+                    if titles is None:
+                        titles = TitleIndex(fils)
+                    best = self._closest_folder(titles, foldd, 3)
                     if best:
-                        pth = join('/',best)
-                        ram.writetext(join(pth,j),join(path,j))
+                        layout.add(best, j.name, join(path, j.name), pp, j)
                     else:
-                        if not(ram.exists('/subs')):
-                            ram.makedir('/subs')
-                        ram.writetext(join('/subs',j),join(path,j))
+                        layout.add('subs', j.name, join(path, j.name), pp, j)
                 else:
-                    if not(ram.exists('/subs')):
-                        ram.makedir('/subs')
-                    ram.writetext(join('/subs',j),join(path,j))
+                    layout.add('subs', j.name, join(path, j.name), pp, j)
 
-            for j in posprocimg:
-                pp = parse(j)
+            for k in posprocimg:
+                j = files[k]
+                pp = table.data[k]
                 foldd = transform(pp['title'])
                 if pp.season:
                     fold = foldd + ' - '+temp_format(pp['season'])
                 else:
                     fold = foldd
-                pth = join('/',fold)
-                if ram.exists(pth):
-                    ram.writetext(join(pth,j),join(path,j))
+                if fold in layout:
+                    layout.add(fold, j.name, join(path, j.name), pp, j)
                 elif len(fils)==1:
-                    pth = join('/',list(fils)[0])
-                    ram.writetext(join(pth,j),join(path,j))
+                    layout.add(list(fils)[0][0], j.name, join(path, j.name), pp, j)
                 elif len(fils)>1:
-                    best = None
-                    gap = temp_gap+10
-                    for i, v in fils:
-                        n = editDistance(i,foldd)
-                        if n < temp_gap*v + (1-v)*2 and n<gap:
-                            best=i
-                            gap=n
-                        elif n == 0:
-                            best = i
-                            break
+                    if titles is None:
+                        titles = TitleIndex(fils)
+                    best = self._closest_folder(titles, foldd, 2)
                     if best:
-                        pth = join('/',best)
-                        ram.writetext(join(pth,j),join(path,j))
-        return ram
+                        layout.add(best, j.name, join(path, j.name), pp, j)
+        return layout
 
     def organize(self):
         """Reorganize the folder, put each chapter of the same serie
         and season in the same folder, including subtitle"""
-        # make virtual filesystem in ram with the final
-        # organization of the filesystem
+        with self._phase('organize'):
+            self._organize()
+        return self._finish_stats()
+
+    def _organize(self):
+        # make the final organization of the filesystem
         ff = self._dest
-        ram = self._make_temp_fs(ff)
+        layout = self._make_temp_fs(ff)
 
-        # execute ram.tree() for see the structure in pretty format
-        # reorganize the filesystem from the structure in the
-        # virtualfilesistem in ram
-        data = set(ram.listdir('/'))
+        # reorganize the filesystem from the layout
+        data = set(layout.folders())
         for fold in data:
             path = join('/',fold)
             if not(ff.exists(path)):
                 ff.makedir(path)
-            for fil in ram.listdir(path):
-                path2 = join(path, fil)
-                opth = ram.readtext(path2)
+            for entry in layout.files(fold):
+                path2 = join(path, entry.name)
+                opth = entry.source
                 if path2 == opth:
                     continue
                 ff.move(opth, path2)
@@ -653,307 +860,65 @@ class SeriesPerson(DSync):
                 else:
                     ff.removetree(join('/',i.name))
 
-    def sync(self, workers=1, use_hash=True, collition=OVERWRITE):
-        assert workers >= 0
-        sc = self._source
-        ram = self._make_temp_fs(sc)
-        ff = self._dest
-        # execute ram.tree() for see the structure in pretty format
-        # reorganize the filesystem from the structure in the
-        # virtualfilesistem in ram
-        try:
-            data = set(ram.listdir('/'))
-            with sc.lock(), ff.lock():
-                _thread_safe = is_thread_safe(sc, ff)
-                with Copier(num_workers=workers if _thread_safe else 0) as copier:
-                    # iterate over the virtual structure( only folders un the 1st level)
-                    for fold in data:
-                        path = join('/', fold)
-                        if not(ff.exists(path)):
-                            ff.makedir(path)
-                        # iterate over files in each folder
-                        try:
-                            lsd = ram.listdir(path)
-                        except DirectoryExpected:
-                            copier.copy(sc, path, ff, path)
-                        for fil in lsd:
-                            pp = parse(fil)
-                            path2 = join(path, fil)
-                            opth = ram.readtext(join(path, fil))
-                            # if exist the file with the exactly transform name
-                            if ff.exists(path2):
-                                i1 = sc.getinfo(opth, namespaces=['details'])
-                                i2 = ff.getinfo(path2, namespaces=['details'])
-                                if i1.size < i2.size:
-                                    ## if the size of new is less than older du nothing
-                                    continue
-                                elif use_hash and i1.size == i2.size:
-                                    ## if has the same size and hash is avaliable compare the hash
-                                    # h1 = hash_file(sc, opth)
-                                    # h2 = hash_file(ff, path2)
-                                    if hash_files(sc, opth, ff, path2):
-                                        ## if the has coincide are the same file 99.9%
-                                        continue
-                                    # if size are equal but hash are different we have a collition
-                                    if collition == OVERWRITE:
-                                        copier.copy(sc, opth, ff, path2)
-                                    if collition == RENAME:
-                                        nn, ext = splitext(path2)
-                                        num = 2
-                                        temppth = nn+'_rename_'+str(num)+ext
-                                        while ff.exists(temppth):
-                                            num += 1
-                                            temppth = nn+'_rename_'+str(num)+ext
-                                        ff.move(path2, temppth)
-                                        copier.copy(sc, opth, ff, path2)
-                                elif not use_hash and i1.size == i2.size:
-                                    # if size are equal but don use hash we have a collition
-                                    if collition == OVERWRITE:
-                                        copier.copy(sc, opth, ff, path2)
-                                    if collition == RENAME:
-                                        nn, ext = splitext(path2)
-                                        num = 2
-                                        temppth = nn+'_rename_'+str(num)+ext
-                                        while ff.exists(temppth):
-                                            num += 1
-                                            temppth = nn+'_rename_'+str(num)+ext
-                                        ff.move(path2, temppth)
-                                        copier.copy(sc, opth, ff, path2)
-                                else:
-                                    copier.copy(sc, opth, ff, path2)
-                            elif pp.ext in subs_formats:
-                                copier.copy(sc, opth, ff, path2)
-                            elif 'image' in pp['mimetype']:
-                                copier.copy(sc, opth, ff, path2)
-                            # if we have the chapter number
-                            elif pp.episode:
-                                try:
-                                    my = int(str(pp.episode))
-                                except:
-                                    copier.copy(sc, opth, ff, path2)
-                                    continue
-                                name = ''
-                                fillt = pp.title
-                                for filee in ff.listdir(path):
-                                    pp2 = parse(filee)
-                                    if editDistance(pp2.title, fillt) < 3:
-                                        try:
-                                            my2 = int(str(pp2.episode))
-                                        except:
-                                            continue
-                                        if my2 == my:
-                                            name = filee
-                                            break
-                                # if we found a file with similar name and same chapter
-                                if name:
-                                    i1 = sc.getinfo(opth, namespaces=['details'])
-                                    i2 = ff.getinfo(join(path, name), namespaces=['details'])
-                                    if i1.size < i2.size:
-                                        ## if the size of new is less than older du nothing
-                                        continue
-                                    elif use_hash and i1.size == i2.size:
-                                        ## if has the same size and hash is avaliable compare the hash
-                                        temppth = join(path, name)
-                                        # h1 = hash_file(sc, opth)
-                                        # h2 = hash_file(ff, temppth)
-                                        if hash_files(sc, opth, ff, temppth):
-                                            continue
-                                        # if size are equal but hash are different we have a collition
-                                        if collition == OVERWRITE:
-                                            copier.copy(sc, opth, ff, temppth)
-                                        if collition == RENAME:
-                                            nn, ext = splitext(temppth)
-                                            num = 2
-                                            temppth2 = nn+'_rename_'+str(num)+ext
-                                            while ff.exists(temppth2):
-                                                num += 1
-                                                temppth2 = nn+'_rename_'+str(num)+ext
-                                            ff.move(temppth, temppth2)
-                                            copier.copy(sc, opth, ff, temppth)
-                                    elif not use_hash and i1.size == i2.size:
-                                        # if size are equal but don use hash we have a collition
-                                        temppth = join(path, name)
-                                        if collition == OVERWRITE:
-                                            copier.copy(sc, opth, ff, temppth)
-                                        if collition == RENAME:
-                                            nn, ext = splitext(temppth)
-                                            num = 2
-                                            temppth2 = nn+'_rename_'+str(num)+ext
-                                            while ff.exists(temppth2):
-                                                num += 1
-                                                temppth2 = nn+'_rename_'+str(num)+ext
-                                            ff.move(temppth, temppth2)
-                                            copier.copy(sc, opth, ff, temppth)
-                                    else:
-                                        temppth = join(path, name)
-                                        copier.copy(sc, opth, ff, temppth)
-                                else:
-                                    copier.copy(sc, opth, ff, path2)
-
-        except BulkCopyFailed as e:
-            raise BulkCopyFailed(e.errors) ## do somthing with error late, for now just raise again
-
-    def sync_callback(self, callback, use_hash=True, collition=OVERWRITE):
-        sc = self._source
-        ram = self._make_temp_fs(sc)
-        ff = self._dest
-        # execute ram.tree() for see the structure in pretty format
-        # reorganize the filesystem from the structure in the
-        # virtualfilesistem in ram
-        try:
-            data = set(ram.listdir('/'))
-            with sc.lock(), ff.lock():
-                with Copier(num_workers=1) as copier:
-                    # iterate over the virtual structure( only folders un the 1st level)
-                    for fold in data:
-                        path = join('/', fold)
-                        if not(ff.exists(path)):
-                            ff.makedir(path)
-                        # iterate over files in each folder
-                        try:
-                            lsd = ram.listdir(path)
-                        except DirectoryExpected:
-                            copier.copy(sc, path, ff, path)
-                        for fil in lsd:
-                            pp = parse(fil)
-                            path2 = join(path, fil)
-                            opth = ram.readtext(join(path, fil))
-                            # if exist the file with the exactly transform name
-                            if ff.exists(path2):
-                                i1 = sc.getinfo(opth, namespaces=['details'])
-                                i2 = ff.getinfo(path2, namespaces=['details'])
-                                if i1.size < i2.size:
-                                    ## if the size of new is less than older du nothing
-                                    continue
-                                elif use_hash and i1.size == i2.size:
-                                    ## if has the same size and hash is avaliable compare the hash
-                                    # h1 = hash_file(sc, opth)
-                                    # h2 = hash_file(ff, path2)
-                                    if hash_files(sc, opth, ff, path2):
-                                        ## if the has coincide are the same file 99.9%
-                                        continue
-                                    # if size are equal but hash are different we have a collition
-                                    if collition == OVERWRITE:
-                                        copier.copy(sc, opth, ff, path2, callback)
-                                    if collition == RENAME:
-                                        nn, ext = splitext(path2)
-                                        num = 2
-                                        temppth = nn+'_rename_'+str(num)+ext
-                                        while ff.exists(temppth):
-                                            num += 1
-                                            temppth = nn+'_rename_'+str(num)+ext
-                                        ff.move(path2, temppth)
-                                        copier.copy(sc, opth, ff, path2, callback)
-                                elif not use_hash and i1.size == i2.size:
-                                    # if size are equal but don use hash we have a collition
-                                    if collition == OVERWRITE:
-                                        copier.copy(sc, opth, ff, path2, callback)
-                                    if collition == RENAME:
-                                        nn, ext = splitext(path2)
-                                        num = 2
-                                        temppth = nn+'_rename_'+str(num)+ext
-                                        while ff.exists(temppth):
-                                            num += 1
-                                            temppth = nn+'_rename_'+str(num)+ext
-                                        ff.move(path2, temppth)
-                                        copier.copy(sc, opth, ff, path2, callback)
-                                else:
-                                    copier.copy(sc, opth, ff, path2, callback)
-                            elif pp.ext in subs_formats:
-                                copier.copy(sc, opth, ff, path2, callback)
-                            elif 'image' in pp['mimetype']:
-                                copier.copy(sc, opth, ff, path2, callback)
-                            # if we have the chapter number
-                            elif pp.episode:
-                                try:
-                                    my = int(str(pp.episode))
-                                except:
-                                    copier.copy(sc, opth, ff, path2, callback)
-                                    continue
-                                name = ''
-                                fillt = pp.title
-                                for filee in ff.listdir(path):
-                                    pp2 = parse(filee)
-                                    if editDistance(pp2.title, fillt) < 3:
-                                        try:
-                                            my2 = int(str(pp2.episode))
-                                        except:
-                                            continue
-                                        if my2 == my:
-                                            name = filee
-                                            break
-                                # if we found a file with similar name and same chapter
-                                if name:
-                                    i1 = sc.getinfo(opth, namespaces=['details'])
-                                    i2 = ff.getinfo(join(path, name), namespaces=['details'])
-                                    if i1.size < i2.size:
-                                        ## if the size of new is less than older du nothing
-                                        continue
-                                    elif use_hash and i1.size == i2.size:
-                                        ## if has the same size and hash is avaliable compare the hash
-                                        temppth = join(path, name)
-                                        # h1 = hash_file(sc, opth)
-                                        # h2 = hash_file(ff, temppth)
-                                        if hash_files(sc, opth, ff, temppth):
-                                            continue
-                                        # if size are equal but hash are different we have a collition
-                                        if collition == OVERWRITE:
-                                            copier.copy(sc, opth, ff, temppth, callback)
-                                        if collition == RENAME:
-                                            nn, ext = splitext(temppth)
-                                            num = 2
-                                            temppth2 = nn+'_rename_'+str(num)+ext
-                                            while ff.exists(temppth2):
-                                                num += 1
-                                                temppth2 = nn+'_rename_'+str(num)+ext
-                                            ff.move(temppth, temppth2)
-                                            copier.copy(sc, opth, ff, temppth, callback)
-                                    elif not use_hash and i1.size == i2.size:
-                                        # if size are equal but don use hash we have a collition
-                                        temppth = join(path, name)
-                                        if collition == OVERWRITE:
-                                            copier.copy(sc, opth, ff, temppth, callback)
-                                        if collition == RENAME:
-                                            nn, ext = splitext(temppth)
-                                            num = 2
-                                            temppth2 = nn+'_rename_'+str(num)+ext
-                                            while ff.exists(temppth2):
-                                                num += 1
-                                                temppth2 = nn+'_rename_'+str(num)+ext
-                                            ff.move(temppth, temppth2)
-                                            copier.copy(sc, opth, ff, temppth, callback)
-                                    else:
-                                        temppth = join(path, name)
-                                        copier.copy(sc, opth, ff, temppth, callback)
-                                else:
-                                    copier.copy(sc, opth, ff, path2, callback)
-
-        except BulkCopyFailed as e:
-            raise BulkCopyFailed(e.errors) ## do somthing with error late, for now just raise again
 
-
-def organize(path, typee = PSERIE):
+def organize(path, typee = PSERIE, stats=False, parse_db=None):
+    """With stats return the SyncStats of the run.
+    parse_db is the sqlite file that keeps the parsed names between runs"""
     ff = fs.open_fs(path)
     if typee == PSERIE:
-        with SeriesPerson(MemoryFS(), ff) as tt:
-            tt.organize()
+        klass = SeriesPerson
     elif typee == ANIME:
-        with SeriesAnimes(MemoryFS(), ff) as tt:
-            tt.organize()
+        klass = SeriesAnimes
     else:
-        with Movies(MemoryFS(), ff) as tt:
-            tt.organize()
-
-def sync(sc_path, dest_path, typee = ANIME, workers=1, use_hash=False, collition=OVERWRITE):
+        klass = Movies
+    with klass(MemoryFS(), ff, stats=stats, parse_db=parse_db) as tt:
+        return tt.organize()
+
+def sync(sc_path, dest_path, typee = ANIME, workers=1, use_hash=False, collition=OVERWRITE,
+         hash_cache=None, fast_equal=False, hash_algorithm='sha1', concurrent_hash=False,
+         dry_run=False, parse_workers=0, adaptive_chunks=False, bandwidth=None,
+         resume=False, progress=None, stats=False, pool_size=None, pool_idle=60.0,
+         parse_db=None):
+    """hash_cache can be a HashCache or the path of its database file.
+    With dry_run nothing is copied and the SyncPlan is returned.
+    adaptive_chunks tunes the copy chunk size to the filesystems.
+    bandwidth limits the copy to bytes/s, a TokenBucket allows change it
+    while the sync runs. With resume interrupted copies of big files
+    continue in the next sync.
+    progress is called with a SyncProgress, at most 4 times per second.
+    With stats return the SyncStats of the run (dump it with to_json).
+    With workers the filesystems that are not thread safe (like smb) open
+    a connection for each copy from their url, at most pool_size (workers
+    by default) at a time, and keep them pool_idle seconds without use.
+    parse_db is the sqlite file that keeps the parsed names between runs."""
     assert workers >= 0
     ff2 = fs.open_fs(sc_path)
     ff = fs.open_fs(dest_path)
+    pools = {}
+    if workers > 1:
+        for key, fsi, url in (('source_pool', ff2, sc_path), ('dest_pool', ff, dest_path)):
+            if not is_thread_safe(fsi):
+                pools[key] = ConnectionPool(url, pool_size or workers, pool_idle)
+    cache = hash_cache
+    if isinstance(hash_cache, str):
+        cache = HashCache(hash_cache)
+    options = dict(hash_cache=cache, fast_equal=fast_equal,
+                   hash_algorithm=hash_algorithm, concurrent_hash=concurrent_hash,
+                   parse_workers=parse_workers, adaptive_chunks=adaptive_chunks,
+                   bandwidth=bandwidth, resume=resume, stats=stats,
+                   parse_db=parse_db, **pools)
     if typee == PSERIE:
-        with SeriesPerson(ff2, ff) as tt:
-            tt.sync(workers, use_hash, collition)
+        klass = SeriesPerson
     elif typee == ANIME:
-        with SeriesAnimes(ff2, ff) as tt:
-            tt.sync(workers, use_hash, collition)
+        klass = SeriesAnimes
     else:
-        with Movies(ff2, ff) as tt:
-            tt.sync(workers, use_hash, collition)
\ No newline at end of file
+        klass = Movies
+    try:
+        with klass(ff2, ff, **options) as tt:
+            if dry_run:
+                return tt.plan(use_hash, collition)
+            return tt.sync(workers, use_hash, collition,
+                           SyncProgress(callback=progress) if progress else None)
+    finally:
+        if cache is not hash_cache:
+            cache.close()
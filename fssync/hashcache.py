@@ -0,0 +1,193 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import weakref
+from fs.info import Info
+from fs.memoryfs import MemoryFS
+from fs.errors import NoSysPath, ResourceNotFound
+from .copier import fs_inner
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    fs TEXT NOT NULL,
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    digest TEXT NOT NULL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (fs, path, algorithm)
+)
+"""
+
+
+def fs_identity(fsi):
+    """Return a stable identifier for the filesystem behind fsi.
+
+    Wrappers (read_only, cache_directory, ...) are removed first, so the
+    same share gives the same identity as source and as destination.
+    Returns None for filesystems that can't be identified between runs.
+    """
+    fsi = fs_inner(fsi)
+    if isinstance(fsi, MemoryFS):
+        return None
+    try:
+        ident = 'sys:' + os.path.normcase(os.path.abspath(fsi.getsyspath('/')))
+    except NoSysPath:
+        # repr of network filesystems can carry credentials, never store it raw
+        ident = type(fsi).__name__ + ':' + repr(fsi)
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+
+def _mtime(info):
+    modified = info.modified
+    if modified is None:
+        return None
+    return modified.timestamp()
+
+
+class HashCache(object):
+    """On-disk cache of file digests backed by SQLite.
+
+    Entries are keyed by filesystem identity, path and algorithm, and are
+    only valid while the size and modification time of the file are the
+    same that when the digest was stored.
+
+    :param path: database file, None keeps the cache in memory
+    :param max_age: entries not used in max_age seconds are dropped by vacuum
+
+    The last use of the hits is saved with the next put, evict, flush or
+    close, not one commit for each hit.
+    """
+
+    def __init__(self, path=None, max_age=None):
+        self.path = path
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._identities = weakref.WeakKeyDictionary()
+        # (fs, path, algorithm) of the hits to their last use, not saved yet
+        self._used = {}
+        self._db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        with self._lock:
+            self._db.execute(_SCHEMA)
+            self._db.commit()
+
+    def _identity(self, fsi):
+        if fsi not in self._identities:
+            self._identities[fsi] = fs_identity(fsi)
+        return self._identities[fsi]
+
+    def _key(self, fsi, path, info):
+        ident = self._identity(fsi)
+        if ident is None:
+            return None
+        if info is None:
+            try:
+                info = fsi.getinfo(path, namespaces=['details'])
+            except ResourceNotFound:
+                return None
+        # an Info or a layout Entry (with size and mtime)
+        mtime = _mtime(info) if isinstance(info, Info) else info.mtime
+        if mtime is None:
+            return None
+        return ident, path, info.size, mtime
+
+    def get(self, fsi, path, algorithm='sha1', info=None):
+        """Return the cached digest of path or None.
+        info is an optional Info with the details namespace (or a layout
+        Entry), it saves a getinfo call when the caller already has it."""
+        key = self._key(fsi, path, info)
+        if key is None:
+            self.misses += 1
+            return None
+        ident, path, size, mtime = key
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest FROM hashes WHERE fs=? AND path=? AND algorithm=? '
+                'AND size=? AND mtime=?',
+                (ident, path, algorithm, size, mtime)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._used[(ident, path, algorithm)] = time.time()
+            self.hits += 1
+        return row[0]
+
+    def _save_used(self):
+        """Write the last use of the hits, the caller holds the lock and commits"""
+        if self._used:
+            self._db.executemany(
+                'UPDATE hashes SET atime=? WHERE fs=? AND path=? AND algorithm=?',
+                [(atime,) + key for key, atime in self._used.items()])
+            self._used = {}
+
+    def put(self, fsi, path, digest, algorithm='sha1', info=None):
+        """Store the digest of path."""
+        key = self._key(fsi, path, info)
+        if key is None:
+            return
+        ident, path, size, mtime = key
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (ident, path, algorithm, size, mtime, digest, time.time()))
+            self._save_used()
+            self._db.commit()
+
+    def evict(self, max_age=None):
+        """Remove the entries not used in the last max_age seconds.
+        Return the number of removed entries."""
+        max_age = self.max_age if max_age is None else max_age
+        if max_age is None:
+            return 0
+        with self._lock:
+            self._save_used()
+            cur = self._db.execute('DELETE FROM hashes WHERE atime<?',
+                                   (time.time() - max_age,))
+            self._db.commit()
+        return cur.rowcount
+
+    def vacuum(self):
+        """Evict old entries and compact the database file."""
+        removed = self.evict()
+        with self._lock:
+            self._db.execute('VACUUM')
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._used = {}
+            self._db.execute('DELETE FROM hashes')
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'ratio': self.hits/total if total else 0.0}
+
+    def flush(self):
+        """Save the last use of the hits"""
+        with self._lock:
+            if self._used:
+                self._save_used()
+                self._db.commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
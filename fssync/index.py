@@ -0,0 +1,188 @@
+from fs.path import join
+from .utils import editDistance, episode_number
+from .parser_serie import transform
+from .copier import PART_SUFFIX, CHECKPOINT_SUFFIX
+
+
+def normalize_title(title):
+    return transform(str(title)).lower()
+
+
+class EpisodeIndex(object):
+    """Files of one destination folder indexed by title and episode number.
+
+    Built with a single scandir of the folder, so the existence checks, the
+    sizes and the search of the same episode under another name don't need
+    more calls to the filesystem nor parse all the folder for each file.
+
+    :param fsi: filesystem of the folder
+    :param path: folder path
+    :param parser: function name -> CapData (rename or parse_serie_guessit)
+    :param max_distance: titles at edit distance below this are the same serie
+    """
+
+    def __init__(self, fsi, path, parser, max_distance=3):
+        self._fs = fsi
+        self._path = path
+        self._parser = parser
+        self._max_distance = max_distance
+        self._infos = {}
+        self._exact = {}
+        self._episodes = {}
+
+    @classmethod
+    def from_folder(cls, fsi, path, parser, max_distance=3):
+        index = cls(fsi, path, parser, max_distance)
+        for info in fsi.scandir(path, namespaces=['details']):
+            # unfinished copies are not files of the folder yet
+            if info.is_file and not info.name.endswith((PART_SUFFIX, CHECKPOINT_SUFFIX)):
+                index.add(info.name, info)
+        return index
+
+    def add(self, name, info=None):
+        """Register name in the folder, info is an Info with details or None"""
+        self._infos[name] = info
+        try:
+            pp = self._parser(name)
+            title = pp.title
+            ep = episode_number(pp.episode)
+        except KeyError:
+            return
+        if ep is None:
+            return
+        title = normalize_title(title)
+        self._exact.setdefault((title, ep), name)
+        candidates = self._episodes.setdefault(ep, [])
+        if name not in (n for t, n in candidates):
+            candidates.append((title, name))
+
+    def discard(self, name):
+        if self._infos.pop(name, False) is False:
+            return
+        for ep, candidates in list(self._episodes.items()):
+            for item in candidates:
+                if item[1] == name:
+                    candidates.remove(item)
+                    if self._exact.get((item[0], ep)) == name:
+                        del self._exact[(item[0], ep)]
+                        for t, n in candidates:
+                            if t == item[0]:
+                                self._exact[(t, ep)] = n
+                                break
+                    break
+
+    def move(self, name, new_name):
+        self.discard(name)
+        self.add(new_name)
+
+    def __contains__(self, name):
+        return name in self._infos
+
+    def __len__(self):
+        return len(self._infos)
+
+    def getinfo(self, name):
+        """Info with the details namespace of name, fetched if unknown"""
+        info = self._infos.get(name)
+        if info is None:
+            info = self._fs.getinfo(join(self._path, name), namespaces=['details'])
+            self._infos[name] = info
+        return info
+
+    def find(self, title, episode):
+        """Name of a file of the same serie (title) and episode number or None"""
+        ep = episode_number(episode)
+        if ep is None:
+            return None
+        title = normalize_title(title)
+        name = self._exact.get((title, ep))
+        if name is not None:
+            return name
+        for t, n in self._episodes.get(ep, ()):
+            if editDistance(t, title, limit=self._max_distance) < self._max_distance:
+                return n
+        return None
+
+
+class TitleIndex(object):
+    """BK-tree of titles for "closest title within distance k" queries.
+
+    Only the subtrees that can hold a title close enough are visited, so a
+    query doesn't compute the distance against every title.
+
+    :param titles: iterable of titles or (title, value) pairs
+    :param lower: compare the titles ignoring the case
+    """
+
+    def __init__(self, titles=(), lower=False):
+        self._lower = lower
+        self._root = None
+        self._values = {}
+        for i in titles:
+            if isinstance(i, tuple):
+                self.add(*i)
+            else:
+                self.add(i)
+
+    def _norm(self, title):
+        return title.lower() if self._lower else title
+
+    def add(self, title, value=None):
+        key = self._norm(title)
+        if key in self._values:
+            return
+        self._values[key] = (title, value)
+        if self._root is None:
+            self._root = (key, {})
+            return
+        node = self._root
+        while True:
+            d = editDistance(key, node[0])
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (key, {})
+                return
+            node = child
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, title):
+        return self._norm(title) in self._values
+
+    def search(self, title, limit):
+        """All the (distance, title, value) with distance below limit"""
+        key = self._norm(title)
+        res = []
+        if self._root is None:
+            return res
+        if key in self._values:
+            res.append((0, ) + self._values[key])
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = editDistance(key, node[0])
+            if 0 < d < limit:
+                res.append((d, ) + self._values[node[0]])
+            for e, child in node[1].items():
+                if d - limit < e < d + limit:
+                    stack.append(child)
+        return res
+
+    def nearest(self, title, limit):
+        """Closest (distance, title, value) with distance below limit or None"""
+        key = self._norm(title)
+        if key in self._values:
+            return (0, ) + self._values[key]
+        best = None
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = editDistance(key, node[0])
+            if d < limit:
+                best = (d, ) + self._values[node[0]]
+                limit = d
+            for e, child in node[1].items():
+                if d - limit < e < d + limit:
+                    stack.append(child)
+        return best
@@ -0,0 +1,73 @@
+from fs.memoryfs import MemoryFS
+from fs.path import join
+
+
+class Entry(object):
+    """A file of the layout: its name in the target folder, the path in the
+    original filesystem, the parsed name (CapData), and the size in bytes
+    and modification time (timestamp) of the walk, so nobody has to ask for
+    them again."""
+
+    __slots__ = ('name', 'source', 'meta', 'size', 'mtime')
+
+    def __init__(self, name, source, meta=None, size=None, mtime=None):
+        self.name = name
+        self.source = source
+        self.meta = meta
+        self.size = size
+        self.mtime = mtime
+
+    def __repr__(self):
+        return 'Entry({!r}, {!r})'.format(self.name, self.source)
+
+
+class Layout(object):
+    """Final organization of the files, computed before touching anything.
+
+    Maps each first level folder to its files by name. A name added twice
+    to the same folder keeps the last entry.
+    """
+
+    __slots__ = ('_folders',)
+
+    def __init__(self):
+        self._folders = {}
+
+    def makedir(self, folder):
+        if folder not in self._folders:
+            self._folders[folder] = {}
+
+    def add(self, folder, name, source, meta=None, info=None):
+        """info is the Info (with details) of the file, only its size and
+        modification time are kept"""
+        size = mtime = None
+        if info is not None:
+            size = info.size
+            modified = info.modified
+            mtime = modified.timestamp() if modified is not None else None
+        self.makedir(folder)
+        self._folders[folder][name] = Entry(name, source, meta, size, mtime)
+
+    def __contains__(self, folder):
+        return folder in self._folders
+
+    def __len__(self):
+        return sum(len(i) for i in self._folders.values())
+
+    def folders(self):
+        return list(self._folders)
+
+    def files(self, folder):
+        """Entries of folder"""
+        return list(self._folders[folder].values())
+
+    def to_memoryfs(self):
+        """The layout as a MemoryFS where each file contains its source path,
+        execute .tree() on it for see the structure in pretty format"""
+        ram = MemoryFS()
+        for folder, files in self._folders.items():
+            pth = join('/', folder)
+            ram.makedir(pth)
+            for entry in files.values():
+                ram.writetext(join(pth, entry.name), entry.source)
+        return ram
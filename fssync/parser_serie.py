@@ -2,6 +2,7 @@ import re
 import os
 import sys
 import json
+from functools import lru_cache
 from .stopwords import stopwords
 if hasattr(sys, 'frozen'):
     MODULE = os.path.dirname(sys.executable)
@@ -34,6 +35,7 @@ upperm = re.compile('[A-Z].*[A-Z]')
 letn = re.compile('[0-9][a-z]',re.I)
 
 
+@lru_cache(maxsize=8192)
 def transform(txt):
     res = []
     for n,i in enumerate(txt.split()):
@@ -50,194 +52,239 @@ def transform(txt):
     return ' '.join(res).strip()
 
 
+# any of tv, days, dates or resolution, in a single pass
+cleaner = re.compile('|'.join([tv.pattern, '(?i:'+days.pattern+')', dates.pattern,
+                               resolution.pattern]))
+escapes = str.maketrans({'?': '\\?', '+': '\\+', '.': '\\.'})
+splitter = re.compile('('+tokens.pattern+')')
+number = re.compile('[0-9]{1,4}')
+letters = re.compile('[A-Za-z]+')
+cross = re.compile('[0-9]{1,4}[xX][0-9]{1,4}')
+
+
 def clean(txt):
-    txt = txt.replace('?','\?')
-    txt = txt.replace('+','\+')
-    txt = txt.replace('.','\.')
-    txt = tv.sub(' ',txt)
-    txt = days.sub('', txt)
-    txt = dates.sub('', txt)
-    txt = resolution.sub('', txt)
+    txt = txt.translate(escapes)
+    if cleaner.search(txt):
+        # a removal can join the text around it in a new match of the
+        # next pattern, so the order of the passes matters
+        txt = tv.sub(' ',txt)
+        txt = days.sub('', txt)
+        txt = dates.sub('', txt)
+        txt = resolution.sub('', txt)
     txt = garbage.sub('', txt)
     txt = normsp.sub(' ', txt)
     return txt.strip()
 
 
 def parse(txt):
-    toks = []
-    for i in tokens.finditer(txt):
-        toks.append(i.group())
-    seps = []
-    for i in tokens.split(txt):
-       if len(i) > 1 and clopgp.match(i.strip()):
-           i = i.strip()
-           seps.append(i[0])
-           toks.insert(len(seps)-1, '')
-           seps.append(i[1])
-       else:
-           seps.append(i)
-    if len(seps) == 0:
-        return toks, ['']
+    """Split txt in tokens and the separator that follows each token,
+    both lists with the same length"""
+    parts = splitter.split(txt)
+    toks = parts[1::2]
+    seps = parts[0::2]
+    if any(len(i) > 1 and clopgp.match(i.strip()) for i in seps):
+        # ][ }{ )( between tokens means an empty group
+        toks2 = []
+        seps2 = []
+        for n, sep in enumerate(seps):
+            if len(sep) > 1 and clopgp.match(sep.strip()):
+                sep = sep.strip()
+                seps2.append(sep[0])
+                toks2.append('')
+                seps2.append(sep[1])
+            else:
+                seps2.append(sep)
+            if n < len(toks):
+                toks2.append(toks[n])
+        toks, seps = toks2, seps2
     if seps[0] == '':
-        seps = seps[1:]
+        del seps[0]
     if seps[-1] == '' and len(seps) != len(toks):
-        seps = seps[:-1]
+        seps.pop()
     if groupsop.search(seps[0]):
-        toks = ['']+toks
-    while len(seps) != len(toks):
-        if len(seps)<len(toks):
-            seps = seps+['']
-        else:
-            toks = toks+['']
+        toks.insert(0, '')
+    diff = len(toks) - len(seps)
+    if diff > 0:
+        seps.extend([''] * diff)
+    elif diff < 0:
+        toks.extend([''] * -diff)
     return toks, seps
 
 
-def process(toks, seps, data={}, deep=0, nep = True):
-    # proc []{}()
-    while len(seps) != len(toks):
-        seps = seps+['']
-    if len(toks) == 1 and deep == 0:
-        ff = captemp.search(toks[0])
+# token kinds in process
+PLAIN = 0
+EPI = 1
+EPIN = 2
+CANDIDATE = 3
+
+
+@lru_cache(maxsize=8192)
+def _kind(tok):
+    """Kind of token and, for the episode candidates, its base score"""
+    if epi.search(tok):
+        return EPI, 0
+    if epin.search(tok):
+        return EPIN, 0
+    if captemp.search(tok) and not ordinal.search(tok):
+        return CANDIDATE, int(bool(letters.search(tok))) - int(bool(cross.search(tok)))
+    return PLAIN, 0
+
+
+@lru_cache(maxsize=1024)
+def _group(sep):
+    """(opens a group, closes a group) for a separator"""
+    return bool(groupsop.search(sep)), bool(groupscl.search(sep))
+
+
+@lru_cache(maxsize=8192)
+def _upper(tok):
+    return bool(upperm.search(tok))
+
+
+def _join(toks, seps, pos, data):
+    """Build the serie name (tokens before pos) and the episode name
+    (tokens after pos) joining the tokens by their separators"""
+    namee = ''
+    nameep = ''
+    after = ''
+    check = False
+    for nn, (tok, sep) in enumerate(zip(toks, seps)):
+        if nn == pos:
+            continue
+        if nn < pos:
+            if check:
+                if tok in keep:
+                    namee += '-'
+                elif _upper(tok) and _upper(after):
+                    namee += '-'
+                else:
+                    namee += ' '
+                check = False
+            if sep == '-':
+                check = True
+                namee += tok
+                after = tok
+            else:
+                check = False
+                namee += tok
+                namee += ' '
+                after = ''
+        else:
+            if check:
+                if tok in keep:
+                    nameep += '-'
+                elif _upper(tok) and _upper(after):
+                    namee += '-'
+                else:
+                    nameep += ' '
+                check = False
+            if sep == '-':
+                check = True
+                nameep += tok
+                after = tok
+            else:
+                check = False
+                nameep += tok
+                nameep += ' '
+                after = ''
+    data['name'] = transform(namee)
+    data['nameep'] = transform(nameep)
+
+
+def _process(toks, seps, lo, hi, nseps, data, deep):
+    """Work over the view toks[lo:hi] with the separators seps[lo:lo+nseps],
+    padded with '' until the length of the tokens, without copying them"""
+    size = hi - lo
+    if size == 1 and deep == 0:
+        tok = toks[lo]
+        ff = captemp.search(tok)
         if ff:
             data['cap'] = ff.group()
-            data['name'] = captemp.sub('', toks[0], 1)
+            data['name'] = captemp.sub('', tok, 1)
             data['nameep'] = ''
         else:
             data['cap'] = ''
-            data['name'] = toks[0]
+            data['name'] = tok
             data['nameep'] = ''
         return data
     ungrouptoks = []
     ungroupseps = []
     op = 0
     gp = False
-    qq = []
-    i = 0
-    while i < len(seps):
-        if not gp and groupsop.search(seps[i]):
-            if i != 0 and toks[i] != '':
+    sepend = lo + nseps
+    for i in range(lo, hi):
+        sep = seps[i] if i < sepend else ''
+        opens, closes = _group(sep)
+        if not gp and opens:
+            if i != lo and toks[i] != '':
                 ungrouptoks.append(toks[i])
             op = i
             gp = True
-        elif gp and groupscl.search(seps[i]):
-            jump = i-op
-            data = process(toks[op+1:op+jump+1],
-                           seps[op+1:op+jump], data, deep+1)
-            qq.append((op, i))
+        elif gp and closes:
+            data = _process(toks, seps, op+1, i+1, i-op-1, data, deep+1)
             gp = False
         elif not gp:
             ungrouptoks.append(toks[i])
-            ungroupseps.append(seps[i])
-        i += 1
-    while len(ungroupseps) != len(ungrouptoks):
-        ungroupseps = ungroupseps+['']
-    i = 0
+            ungroupseps.append(sep)
+    ntoks = len(ungrouptoks)
+    if len(ungroupseps) < ntoks:
+        ungroupseps.extend([''] * (ntoks - len(ungroupseps)))
     capflag = not('cap' in data)
     if not('capcandidate' in data):
         data['capcandidate'] = []
-    # if deep == 0:
-    name = {'toks': [], 'seps': []}
-    #print(ungrouptoks, ungroupseps)
-    while i < len(ungrouptoks):
-        if capflag and epi.search(ungrouptoks[i]):
-            if i+1 < len(ungrouptoks):
-                ff = re.search('[0-9]{1,4}', ungrouptoks[i+1])
+    candidates = data['capcandidate']
+    nametoks = []
+    nameseps = []
+    i = 0
+    while i < ntoks:
+        tok = ungrouptoks[i]
+        kind, score = _kind(tok) if capflag else (PLAIN, 0)
+        if kind == EPI:
+            if i+1 < ntoks:
+                ff = number.search(ungrouptoks[i+1])
                 if ff:
                     data['cap'] = int(ff.group())
                     capflag = False
                     i += 1
-        elif capflag and epin.search(ungrouptoks[i]):
-            ff = captemp.search(ungrouptoks[i])
-            data['cap'] = int(ff.group())
+        elif kind == EPIN:
+            data['cap'] = int(captemp.search(tok).group())
             capflag = False
-        elif capflag and captemp.search(ungrouptoks[i]) and not ordinal.search(ungrouptoks[i]):
-            data['capcandidate'].append(
-                (ungrouptoks[i], int(bool(re.search('[A-Za-z]+', ungrouptoks[i]))) -
-                 int(bool(re.search('[0-9]{1,4}[xX][0-9]{1,4}', ungrouptoks[i]))) +
-                 1-i/len(ungrouptoks), len(name['toks'])))
+        elif kind == CANDIDATE:
+            candidates.append((tok, score + 1-i/ntoks, len(nametoks)))
             if deep == 0:
-                name['toks'].append(ungrouptoks[i])
-                name['seps'].append(ungroupseps[i])
+                nametoks.append(tok)
+                nameseps.append(ungroupseps[i])
         elif deep == 0:
-            name['toks'].append(ungrouptoks[i])
-            name['seps'].append(ungroupseps[i])
+            nametoks.append(tok)
+            nameseps.append(ungroupseps[i])
         i += 1
-    if deep == 0 and capflag:
-        capcandidate = list(sorted(data['capcandidate'], key=lambda x: x[1]))
-        if len(capcandidate) == 0:
+    if deep != 0:
+        return data
+    if capflag:
+        if len(candidates) == 0:
             data['cap'] = ''
-            data['pos'] = -1
-        elif len(capcandidate) == 1:
-            ff = captemp.search(capcandidate[0][0])
-            data['cap'] = ff.group()
-            data['pos'] = capcandidate[0][2]
-        elif len(list(filter(lambda x: x[1] == 0, capcandidate))) == 1:
-            ff = captemp.search(capcandidate[0][0])
-            data['cap'] = ff.group()
-            data['pos'] = capcandidate[0][2]
+            pos = -1
         else:
-            ff = captemp.search(capcandidate[0][0])
-            data['cap'] = ff.group()
-            data['pos'] = capcandidate[0][2]
-    if deep == 0:
-        if not('pos' in data):
-            data['pos']=len(name['toks'])+10
-        namee = ''
-        nameep = ''
-        after = ''
-        check = False
-        for nn, (tok, sep) in enumerate(zip(name['toks'], name['seps'])):
-            if nn == data['pos']:
-                continue
-            if nn < data['pos']:
-                if check:
-                    if tok in keep:
-                        namee += '-'
-                    elif upperm.search(tok) and upperm.search(after):
-                        namee += '-'
-                    else:
-                        namee += ' '
-                    check = False
-                if sep == '-':
-                    check = True
-                    namee += tok
-                    after = tok
-                else:
-                    check = False
-                    namee += tok
-                    namee += ' '
-                    after = ''
-            else:
-                if check:
-                    if tok in keep:
-                        nameep += '-'
-                    elif upperm.search(tok) and upperm.search(after):
-                        namee += '-'
-                    else:
-                        nameep += ' '
-                    check = False
-                if sep == '-':
-                    check = True
-                    nameep += tok
-                    after = tok
-                else:
-                    check = False
-                    nameep += tok
-                    nameep += ' '
-                    after = ''
-        namee = transform(namee)
-        nameep = transform(nameep)
-        data['name'] = namee
-        data['nameep'] = nameep
-    if deep == 0:
-        data.pop('capcandidate')
-        data.pop('pos')
+            best = min(candidates, key=lambda x: x[1])
+            data['cap'] = captemp.search(best[0]).group()
+            pos = best[2]
+    else:
+        pos = len(nametoks)+10
+    _join(nametoks, nameseps, pos, data)
+    del data['capcandidate']
     return data
 
 
+def process(toks, seps, data=None, deep=0, nep=True):
+    if data is None:
+        data = {}
+    if len(seps) < len(toks):
+        seps = seps + [''] * (len(toks) - len(seps))
+    return _process(toks, seps, 0, len(toks), len(seps), data, deep)
+
+
 def rename_serie(txt):
     cc = clean(txt)
     toks, seps = parse(cc)
-    #print(toks,seps)
     res = process(toks, seps, {})
-    return res['name'], res['cap'], res['nameep']
\ No newline at end of file
+    return res['name'], res['cap'], res['nameep']
@@ -0,0 +1,141 @@
+import json
+from fs.path import dirname
+
+COPY = 'copy'
+OVERWRITE = 'overwrite'
+RENAME_COPY = 'rename_copy'
+SKIP = 'skip'
+
+KINDS = (COPY, OVERWRITE, RENAME_COPY, SKIP)
+
+
+class Operation(object):
+    """One decision of a sync plan.
+
+    kind is one of COPY, OVERWRITE, RENAME_COPY or SKIP, src is the path in
+    the source, dst the path in the destination and size the bytes that
+    will be transferred. In RENAME_COPY the file in dst is first moved to
+    rename_to. reason is a short human readable explanation.
+    """
+
+    __slots__ = ('kind', 'src', 'dst', 'size', 'rename_to', 'reason')
+
+    def __init__(self, kind, src, dst, size=0, rename_to=None, reason=''):
+        if kind not in KINDS:
+            raise ValueError('unknown operation '+str(kind))
+        self.kind = kind
+        self.src = src
+        self.dst = dst
+        self.size = size
+        self.rename_to = rename_to
+        self.reason = reason
+
+    @property
+    def transfer(self):
+        """Bytes to copy for this operation"""
+        return 0 if self.kind == SKIP else self.size
+
+    def to_dict(self):
+        return {i: getattr(self, i) for i in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def __repr__(self):
+        if self.kind == RENAME_COPY:
+            return 'Operation({}, {!r} -> {!r}, {!r} -> {!r})'.format(
+                self.kind, self.dst, self.rename_to, self.src, self.dst)
+        return 'Operation({}, {!r} -> {!r})'.format(self.kind, self.src, self.dst)
+
+
+class SyncPlan(object):
+    """What a sync will do, built without touching the destination.
+
+    Holds the folders to create and the operations in the order they were
+    decided. Can be inspected (dry-run), serialized to json and executed
+    later with execute_plan.
+    """
+
+    def __init__(self, operations=None, folders=None):
+        self.operations = list(operations or [])
+        self.folders = list(folders or [])
+
+    def makedir(self, path):
+        self.folders.append(path)
+
+    def add(self, kind, src, dst, size=0, rename_to=None, reason=''):
+        op = Operation(kind, src, dst, size, rename_to, reason)
+        self.operations.append(op)
+        return op
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def transfers(self):
+        """Operations that copy data"""
+        return [op for op in self.operations if op.kind != SKIP]
+
+    @property
+    def total_bytes(self):
+        return sum(op.transfer for op in self.operations)
+
+    def count(self, kind):
+        return sum(1 for op in self.operations if op.kind == kind)
+
+    def summary(self):
+        res = {kind: self.count(kind) for kind in KINDS}
+        res['folders'] = len(self.folders)
+        res['bytes'] = self.total_bytes
+        return res
+
+    def describe(self):
+        """Human readable listing of the plan, one line per action"""
+        lines = ['mkdir '+i for i in self.folders]
+        for op in self.operations:
+            if op.kind == SKIP:
+                lines.append('skip {} ({})'.format(op.src, op.reason))
+            elif op.kind == RENAME_COPY:
+                lines.append('move {} -> {}'.format(op.dst, op.rename_to))
+                lines.append('copy {} -> {} [{} bytes]'.format(op.src, op.dst, op.size))
+            else:
+                lines.append('{} {} -> {} [{} bytes]'.format(op.kind, op.src, op.dst, op.size))
+        return '\n'.join(lines)
+
+    def ordered(self):
+        """Operations in execution order: all the renames first, then the
+        copies batched by destination folder"""
+        renames = [op for op in self.operations if op.kind == RENAME_COPY]
+        copies = sorted(self.transfers(), key=lambda op: dirname(op.dst))
+        return renames, copies
+
+    def to_dict(self):
+        return {'folders': self.folders,
+                'operations': [op.to_dict() for op in self.operations]}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([Operation.from_dict(i) for i in data['operations']],
+                   data['folders'])
+
+    @classmethod
+    def from_json(cls, txt):
+        return cls.from_dict(json.loads(txt))
+
+
+def execute_plan(plan, src_fs, dst_fs, copier, callback=None):
+    """Run the plan with copier, renames are done before any copy"""
+    for path in plan.folders:
+        if not dst_fs.exists(path):
+            dst_fs.makedir(path)
+    renames, copies = plan.ordered()
+    for op in renames:
+        dst_fs.move(op.dst, op.rename_to)
+    for op in copies:
+        copier.copy(src_fs, op.src, dst_fs, op.dst, callback, size=op.size or None)
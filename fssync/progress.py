@@ -0,0 +1,128 @@
+import time
+import threading
+
+# weight of the last measure in the smoothed speed
+SPEED_ALPHA = 0.3
+# seconds between measures of the speed
+SPEED_WINDOW = 0.2
+
+
+class SyncProgress(object):
+    """Progress of a whole sync, aggregated from the CountCallbacks of all
+    the copies (it is the callback of the copies).
+
+    Keeps the bytes and files done of the planned totals, a smoothed
+    (EWMA) speed and the ETA. callback receives this object at most once
+    each interval seconds, and always when the last file finish.
+
+    :param plan: SyncPlan with the totals, also can be set later with start
+    :param callback: function that receives the SyncProgress
+    :param interval: min seconds between two calls of callback
+    """
+
+    def __init__(self, plan=None, callback=None, interval=0.25, alpha=SPEED_ALPHA):
+        self.callback = callback
+        self.interval = interval
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.total_files = 0
+        self.bytes_done = 0
+        self.files_done = 0
+        self.speed = 0.0
+        self._files = {}
+        self._started = None
+        self._window_start = None
+        self._window_bytes = 0
+        self._last_call = 0.0
+        if plan is not None:
+            self.start(plan)
+
+    def start(self, plan):
+        """Take the totals from plan and restart the counters"""
+        with self._lock:
+            transfers = plan.transfers()
+            self.total_bytes = sum(op.size for op in transfers)
+            self.total_files = len(transfers)
+            self.bytes_done = 0
+            self.files_done = 0
+            self.speed = 0.0
+            self._files = {}
+            self._started = self._window_start = time.time()
+            self._window_bytes = 0
+
+    @property
+    def files_pending(self):
+        return self.total_files - self.files_done
+
+    @property
+    def current(self):
+        """Destination of the files copying right now"""
+        return list(self._files)
+
+    @property
+    def percent(self):
+        if not self.total_bytes:
+            return 100.0
+        return self.bytes_done/self.total_bytes*100
+
+    @property
+    def elapsed(self):
+        return time.time() - self._started if self._started is not None else 0.0
+
+    @property
+    def eta(self):
+        """Seconds to finish with the current speed, None while unknown"""
+        if not self.speed:
+            return None
+        return max(self.total_bytes - self.bytes_done, 0)/self.speed
+
+    @property
+    def finish(self):
+        return self.files_done >= self.total_files
+
+    def _measure(self, nbytes, now):
+        self._window_bytes += nbytes
+        elapsed = now - self._window_start
+        if elapsed < SPEED_WINDOW:
+            return
+        sample = self._window_bytes/elapsed
+        if self.speed:
+            self.speed = self.alpha*sample + (1 - self.alpha)*self.speed
+        else:
+            self.speed = sample
+        self._window_start = now
+        self._window_bytes = 0
+
+    def __call__(self, count_callback):
+        """Account a chunk of a copy, count_callback is its CountCallback"""
+        now = time.time()
+        with self._lock:
+            if self._started is None:
+                self._started = self._window_start = now
+            key = (count_callback.src, count_callback.dest)
+            prev = self._files.get(key)
+            if prev is None:
+                # the bytes of a resumed copy are done, but not at this speed
+                prev = getattr(count_callback, 'resumed', 0)
+                self.bytes_done += prev
+            delta = count_callback.count - prev
+            self.bytes_done += delta
+            self._measure(delta, now)
+            if count_callback.finish:
+                self._files.pop(key, None)
+                self.files_done += 1
+            else:
+                self._files[key] = count_callback.count
+            emit = self.callback is not None and \
+                (now - self._last_call >= self.interval or self.finish)
+            if emit:
+                self._last_call = now
+        if emit:
+            self.callback(self)
+
+    def to_dict(self):
+        return {'total_bytes': self.total_bytes, 'bytes_done': self.bytes_done,
+                'total_files': self.total_files, 'files_done': self.files_done,
+                'files_pending': self.files_pending, 'speed': self.speed,
+                'eta': self.eta, 'percent': self.percent}
@@ -0,0 +1,165 @@
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from .utils import cache_stats
+from .copier import fs_kind
+from .wrap import ProxyFS
+
+# upper bounds in seconds of the latency histograms, the last bucket is
+# for the slower calls
+LATENCY_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+def _bucket_label(i):
+    if i == len(LATENCY_BUCKETS):
+        return '>{}s'.format(LATENCY_BUCKETS[-1])
+    return '<={}s'.format(LATENCY_BUCKETS[i])
+
+
+class CallStats(object):
+    """Count, total time and latency histogram of one kind of call"""
+
+    __slots__ = ('count', 'seconds', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.histogram = [0]*(len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def to_dict(self):
+        return {'count': self.count, 'seconds': self.seconds,
+                'histogram': {_bucket_label(i): n for i, n in enumerate(self.histogram) if n}}
+
+
+class SyncStats(object):
+    """Measures of a sync or organize run.
+
+    Wall time of each phase (the phases can be nested, plan includes walk,
+    parse and hash), calls and latencies of the filesystems by backend,
+    bytes read and written by backend, bytes hashed and copied, and the
+    hits of the parser and hash caches during the run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {}
+        self.calls = {}
+        self.io = {}
+        self.bytes_hashed = 0
+        self.bytes_copied = 0
+        self.parser_cache = {}
+        self.hash_cache = None
+        self._parser_start = cache_stats()
+        self._copied = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Add the wall time of the block to the phase name"""
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def record_call(self, backend, method, seconds):
+        with self._lock:
+            calls = self.calls.setdefault(backend, {})
+            if method not in calls:
+                calls[method] = CallStats()
+            calls[method].add(seconds)
+
+    def record_io(self, backend, read=0, written=0):
+        with self._lock:
+            io = self.io.setdefault(backend, {'read': 0, 'written': 0})
+            io['read'] += read
+            io['written'] += written
+
+    def bytes_read(self, backend):
+        return self.io.get(backend, {}).get('read', 0)
+
+    def add_hashed(self, nbytes):
+        with self._lock:
+            self.bytes_hashed += nbytes
+
+    def copied(self, count_callback):
+        """Chunk callback of the copies, counts the bytes copied"""
+        with self._lock:
+            key = id(count_callback)
+            # the bytes of a resumed copy were copied by an earlier run
+            prev = self._copied.get(key, getattr(count_callback, 'resumed', 0))
+            self.bytes_copied += count_callback.count - prev
+            if count_callback.finish:
+                self._copied.pop(key, None)
+            else:
+                self._copied[key] = count_callback.count
+
+    def finish(self, hash_cache=None):
+        """Take the statistics of the caches at the end of the run"""
+        end = cache_stats()
+        hits = end['hits'] - self._parser_start['hits']
+        misses = end['misses'] - self._parser_start['misses']
+        self.parser_cache = {'hits': hits, 'misses': misses,
+                             'ratio': hits/(hits + misses) if hits + misses else 0.0}
+        if hash_cache is not None:
+            self.hash_cache = hash_cache.stats
+        return self
+
+    def to_dict(self):
+        with self._lock:
+            return {'phases': dict(self.phases),
+                    'calls': {backend: {method: i.to_dict() for method, i in calls.items()}
+                              for backend, calls in self.calls.items()},
+                    'io': {backend: dict(i) for backend, i in self.io.items()},
+                    'bytes_hashed': self.bytes_hashed,
+                    'bytes_copied': self.bytes_copied,
+                    'parser_cache': self.parser_cache,
+                    'hash_cache': self.hash_cache}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def dump(self, path):
+        """Write the statistics as json in path (of the OS)"""
+        with open(path, 'w') as afile:
+            afile.write(self.to_json(indent=2))
+
+
+class InstrumentedFS(ProxyFS):
+    """Filesystem wrapper that records in a SyncStats the calls, their
+    latency and the bytes read and written of the files it opens.
+
+    :param backend: name of the filesystem in the statistics, by default
+        the class of the filesystem behind the wrappers
+    """
+
+    wrap_name = 'instrumented'
+
+    def __init__(self, wrap_fs, stats, backend=None):
+        super(InstrumentedFS, self).__init__(wrap_fs)
+        self._stats = stats
+        if backend is None:
+            backend = fs_kind(wrap_fs)
+        self.backend = backend
+
+    def _call(self, method, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super(InstrumentedFS, self)._call(method, *args, **kwargs)
+        finally:
+            self._stats.record_call(self.backend, method, time.perf_counter() - t0)
+
+    def _io(self, nbytes, read):
+        if not nbytes:
+            return
+        if read:
+            self._stats.record_io(self.backend, read=nbytes)
+        else:
+            self._stats.record_io(self.backend, written=nbytes)
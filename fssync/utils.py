@@ -2,6 +2,12 @@ import re
 import os
 import sys
 import json
+import atexit
+import sqlite3
+import threading
+from collections import OrderedDict
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from guessit import guessit
 from .parser_serie import rename_serie
 
@@ -37,6 +43,131 @@ class CapData:
     def __str__(self):
         return str(self._things)
 
+# bump when rename or parse_serie_guessit change their results,
+# persisted entries of other versions are ignored
+PARSER_VERSION = 1
+
+_FIELDS = ('title', 'episode_title', 'episode', 'ext', 'is_video', 'error',
+           'season', 'mimetype')
+
+
+def _dump(data):
+    return json.dumps([data[i] for i in _FIELDS])
+
+
+def _load(txt):
+    name, nameep, num, ext, informats, err, season, mimetype = json.loads(txt)
+    return CapData(name, nameep, num, ext, informats, err, season, mimetype)
+
+
+class ParseCache(object):
+    """Bounded LRU cache of parsed file names.
+
+    Optionally backed by a SQLite database (open()) so the results survive
+    between runs, entries are keyed by parser, file name and PARSER_VERSION.
+    The rows are committed in batches, by flush and close (at exit too).
+    """
+
+    def __init__(self, maxsize=65536, path=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._pending = 0
+        self._atexit = False
+        if path:
+            self.open(path)
+
+    def open(self, path):
+        """Use the database in path as persistent store"""
+        self.close()
+        with self._lock:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS parsed ('
+                             'parser TEXT NOT NULL, name TEXT NOT NULL, '
+                             'version INTEGER NOT NULL, data TEXT NOT NULL, '
+                             'PRIMARY KEY (parser, name, version))')
+            self._db.commit()
+            if not self._atexit:
+                atexit.register(self.close)
+                self._atexit = True
+
+    def get(self, parser, name):
+        key = (parser, name)
+        with self._lock:
+            data = self._data.get(key)
+            if data is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return data
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT data FROM parsed WHERE parser=? AND name=? AND version=?',
+                    (parser, name, PARSER_VERSION)).fetchone()
+                if row is not None:
+                    data = _load(row[0])
+                    self._store(key, data)
+                    self.hits += 1
+                    return data
+            self.misses += 1
+        return None
+
+    def _store(self, key, data):
+        self._data[key] = data
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def put(self, parser, name, data):
+        with self._lock:
+            self._store((parser, name), data)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?)',
+                                 (parser, name, PARSER_VERSION, _dump(data)))
+                self._pending += 1
+                if self._pending >= 1000:
+                    self._db.commit()
+                    self._pending = 0
+
+    def flush(self):
+        """Commit the rows saved since the last commit"""
+        with self._lock:
+            if self._db is not None and self._pending:
+                self._db.commit()
+                self._pending = 0
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                'maxsize': self.maxsize, 'ratio': self.hits/total if total else 0.0}
+
+
+parse_cache = ParseCache()
+
+
+def cache_stats():
+    """Statistics of the cache of rename and parse_serie_guessit"""
+    return parse_cache.stats
+
+
 subs_formats = set([".srt",".idx",".sub",".ssa",".ass"])
 video_formats = set([".3g2",
                 ".3gp",
@@ -69,30 +200,106 @@ video_formats = set([".3g2",
                 ".vob"])
 
 
-def editDistance(a, b, lower=False):
+def _peq(a):
+    """Bit masks of the positions of each character of a"""
+    peq = {}
+    bit = 1
+    for c in a:
+        peq[c] = peq.get(c, 0) | bit
+        bit <<= 1
+    return peq
+
+
+def _bitdistance(peq, m, b, limit=None):
+    """Levenshtein distance with the bit-parallel algorithm of Myers (Hyyrö
+    variant for global distance). peq and m come from the pattern, b is the
+    text. With limit stop as soon as the distance can't be lower than it."""
+    n = len(b)
+    if m == 0:
+        return n if limit is None else min(n, limit)
+    if limit is not None and abs(m - n) >= limit:
+        return limit
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    vp = mask
+    vn = 0
+    score = m
+    remaining = n
+    for c in b:
+        remaining -= 1
+        eq = peq.get(c, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        hp = vn | ~(xh | vp)
+        hn = vp & xh
+        if hp & high:
+            score += 1
+        elif hn & high:
+            score -= 1
+        # the last row decrease at most 1 per remaining character
+        if limit is not None and score - remaining >= limit:
+            return limit
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = (hn | ~(xv | hp)) & mask
+        vn = hp & xv
+    return score
+
+
+def editDistance(a, b, lower=False, limit=None):
         """Distancia de Leventein entre dos cadenas de texto.
             a,b son string
+            limit opcional, si la distancia es mayor o igual
+            devuelve limit sin terminar el calculo
             devuelve un int
         """
         if lower:
             a = a.lower()
             b = b.lower()
-        m = []
-        m.append([i for i in range(len(a)+1)])
-        for i in range(len(b)):
-            m.append([i+1]+[0 for i in range(len(a))])
-        for i in range(1, len(b)+1):
-            for j in range(1, len(a)+1):
-                if a[j-1] == b[i-1]:
-                    m[i][j] = m[i-1][j-1]
-                else:
-                    m[i][j] = min(
-                        m[i-1][j-1]+1, min(m[i][j-1]+1, m[i-1][j]+1))
-        ret = m[len(b)][len(a)]
-        return ret
+        if len(a) < len(b):
+            a, b = b, a
+        return _bitdistance(_peq(b), len(b), a, limit)
+
+
+def distances(a, candidates, lower=False, limit=None):
+    """editDistance of a against each candidate, a is preprocessed once"""
+    if lower:
+        a = a.lower()
+    peq = _peq(a)
+    m = len(a)
+    return [_bitdistance(peq, m, c.lower() if lower else c, limit)
+            for c in candidates]
+
+
+def closest(a, candidates, limit, lower=False):
+    """Candidate with the smallest editDistance to a, below limit.
+    Return (candidate, distance) or (None, limit)"""
+    if lower:
+        a = a.lower()
+    peq = _peq(a)
+    m = len(a)
+    best = None
+    for c in candidates:
+        n = _bitdistance(peq, m, c.lower() if lower else c, limit)
+        if n < limit:
+            best = c
+            limit = n
+            if n == 0:
+                break
+    return best, limit
 
 
 def parse_serie_guessit(title, params=None):
+    if params:
+        return _parse_serie_guessit(title, params)
+    data = parse_cache.get('guessit', title)
+    if data is None:
+        data = _parse_serie_guessit(title)
+        parse_cache.put('guessit', title, data)
+    return data
+
+
+def _parse_serie_guessit(title, params=None):
     if not params:
         params = '--json --no-default-config -E -t episode -c \"'+os.path.join(MODULE,'options.json\"')
     txt, ext = os.path.splitext(title)
@@ -124,6 +331,14 @@ def parse_serie_guessit(title, params=None):
 
 
 def rename(name):
+    data = parse_cache.get('rename', name)
+    if data is None:
+        data = _rename(name)
+        parse_cache.put('rename', name, data)
+    return data
+
+
+def _rename(name):
     err = False
     txt, ext = os.path.splitext(name)
     try:
@@ -144,6 +359,171 @@ def rename(name):
     return CapData(t1, t3, t2, ext, bool(ext in video_formats), err)
 
 
+def parse_names(parser, names):
+    """Parse names without cache, parser is 'rename' or 'guessit'.
+    Return the CapData fields of each name or None where the parser fail.
+    Runs in the worker processes of preload."""
+    func = _rename if parser == 'rename' else _parse_serie_guessit
+    res = []
+    for name in names:
+        try:
+            data = func(name)
+        except Exception:
+            res.append(None)
+            continue
+        res.append(tuple(data[i] for i in _FIELDS))
+    return res
+
+
+def preload(parser, batches, workers=None):
+    """Parse batches of names in a process pool, the names not in
+    parse_cache yet. The new results are also saved in parse_cache.
+    :param parser: 'rename' or 'guessit'
+    :param batches: lists of names, usually one per directory
+    :param workers: number of processes, None uses all the cpus
+    :return: dict of name to CapData (None where the parser fail), for
+        the parsed argument of parse_many/rename_many. The results don't
+        come back through parse_cache, it can be smaller than the library.
+    """
+    parsed = {}
+    todo = []
+    for names in batches:
+        missing = []
+        for name in names:
+            if name in parsed:
+                continue
+            data = parse_cache.get(parser, name)
+            if data is None:
+                missing.append(name)
+            parsed[name] = data
+        if missing:
+            todo.append(missing)
+    if not todo:
+        return parsed
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for names, results in zip(todo, pool.map(parse_names, repeat(parser), todo)):
+            for name, fields in zip(names, results):
+                if fields is not None:
+                    data = parsed[name] = CapData(*fields)
+                    parse_cache.put(parser, name, data)
+    return parsed
+
+
+def episode_number(episode):
+    """Integer number of a parsed episode (12, '12', '2x12') or None"""
+    try:
+        ep = str(episode)
+        if 'x' in ep:
+            return int(ep.split('x')[1])
+        elif 'X' in ep:
+            return int(ep.split('X')[1])
+        return int(ep)
+    except (ValueError, IndexError):
+        return None
+
+
+def _season_number(season):
+    try:
+        return int(season)
+    except (TypeError, ValueError):
+        return None
+
+
+class ParsedNames(object):
+    """Result of parse_many/rename_many, one list per field (columns)
+    with the same order of the names.
+    episodes and seasons are int or None, errors is True where the name
+    couldn't be parsed, in that case data (the CapData) is None."""
+
+    __slots__ = ('names', 'titles', 'episode_titles', 'episodes', 'seasons',
+                 'exts', 'is_video', 'errors', 'mimetypes', 'data')
+
+    def __init__(self):
+        for i in self.__slots__:
+            setattr(self, i, [])
+
+    def append(self, name, data):
+        self.names.append(name)
+        self.data.append(data)
+        if data is None:
+            self.titles.append(None)
+            self.episode_titles.append('')
+            self.episodes.append(None)
+            self.seasons.append(None)
+            self.exts.append(os.path.splitext(name)[1])
+            self.is_video.append(False)
+            self.errors.append(True)
+            self.mimetypes.append(None)
+            return
+        things = data._things
+        self.titles.append(things['title'])
+        self.episode_titles.append(things['episode_title'])
+        self.episodes.append(episode_number(things['episode']))
+        self.seasons.append(_season_number(things['season']))
+        self.exts.append(things['ext'])
+        self.is_video.append(things['is_video'])
+        self.errors.append(things['error'])
+        self.mimetypes.append(things['mimetype'])
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(zip(self.names, self.data))
+
+
+def parse_many(names, parser='guessit', parsed=None):
+    """Parse a whole listing, parser is 'guessit' or 'rename'.
+    Repeated names are parsed once and the results go to parse_cache.
+    parsed is a dict of the names already parsed (see preload).
+    Return a ParsedNames."""
+    if parser == 'rename':
+        return rename_many(names, parsed)
+    res = ParsedNames()
+    seen = {}
+    for name in names:
+        if parsed is not None and name in parsed:
+            seen[name] = parsed[name]
+        elif name not in seen:
+            try:
+                seen[name] = parse_serie_guessit(name)
+            except Exception:
+                seen[name] = None
+        res.append(name, seen[name])
+    return res
+
+
+def rename_many(names, parsed=None):
+    """Like parse_many with rename, the names with the same stem (the
+    video and its subtitles) run rename_serie only once."""
+    res = ParsedNames()
+    seen = {}
+    stems = {}
+    for name in names:
+        data = seen.get(name)
+        if data is None and parsed is not None:
+            data = parsed.get(name)
+        if data is None:
+            data = parse_cache.get('rename', name)
+        if data is None:
+            txt, ext = os.path.splitext(name)
+            if txt not in stems:
+                try:
+                    stems[txt] = rename_serie(txt)
+                except (ValueError, IndexError):
+                    stems[txt] = None
+            if stems[txt] is None:
+                # the guessit fallback depends of the whole name
+                data = _rename(name)
+            else:
+                t1, t2, t3 = stems[txt]
+                data = CapData(t1, t3, t2, ext, bool(ext in video_formats), False)
+            parse_cache.put('rename', name, data)
+        seen[name] = data
+        res.append(name, data)
+    return res
+
+
 def temp_format(ss):
     return '[Temp '+str(ss)+']'
 
@@ -0,0 +1,160 @@
+import time
+import threading
+from collections import Counter
+from fs.errors import NoSysPath
+from fs.wrapfs import WrapFS
+from .copier import TokenBucket
+
+
+# methods of the filesystems that ProxyFS passes through _call
+FS_CALLS = ('exists', 'getinfo', 'scandir', 'listdir', 'makedir',
+            'makedirs', 'move', 'remove', 'removetree', 'isdir', 'isfile',
+            'getsize', 'setinfo', 'readbytes', 'readtext', 'writebytes', 'writetext')
+
+
+class ProxyFile(object):
+    """File proxy that tells its owner the bytes of each read and write"""
+
+    def __init__(self, afile, owner):
+        self._file = afile
+        self._owner = owner
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self._owner._io(len(data), True)
+        return data
+
+    def readinto(self, buff):
+        n = self._file.readinto(buff)
+        self._owner._io(n or 0, True)
+        return n
+
+    def write(self, data):
+        n = self._file.write(data)
+        self._owner._io(len(data) if n is None else n, False)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+
+
+def _proxied(method):
+    def call(self, *args, **kwargs):
+        return self._call(method, *args, **kwargs)
+    call.__name__ = method
+    return call
+
+
+class ProxyFS(WrapFS):
+    """Filesystem wrapper that sends openbin and the FS_CALLS through
+    _call, and the reads and writes of the files it opens through _io.
+    The subclasses override the hooks.
+    """
+
+    wrap_name = 'proxy'
+
+    def _call(self, method, *args, **kwargs):
+        return getattr(self._wrap_fs, method)(*args, **kwargs)
+
+    def _io(self, nbytes, read):
+        pass
+
+    def openbin(self, path, mode='r', buffering=-1, **options):
+        afile = self._call('openbin', path, mode, buffering, **options)
+        return ProxyFile(afile, self)
+
+
+for _method in FS_CALLS:
+    setattr(ProxyFS, _method, _proxied(_method))
+
+
+class LatencyFS(ProxyFS):
+    """Filesystem wrapper that makes any filesystem behave like a remote
+    one, for tests and benchmarks.
+
+    Each call (and each read or write of the open files) sleeps latency
+    seconds, the reads and writes share bandwidth bytes per second, and
+    the calls are counted by method in calls, so the round trips of a
+    sync or organize can be checked against a budget.
+
+        slow = LatencyFS(MemoryFS(), latency=0.002, bandwidth=10*1024*1024)
+        ...
+        assert not slow.exceeded({'exists': 100, 'total': 500})
+
+    The wrapper has no system paths, the copies can't skip it with the
+    zero copy of the OS.
+
+    :param latency: seconds of each round trip
+    :param bandwidth: bytes per second of the files, None is unlimited
+    """
+
+    wrap_name = 'latency'
+
+    def __init__(self, wrap_fs, latency=0.0, bandwidth=None):
+        super(LatencyFS, self).__init__(wrap_fs)
+        self.latency = latency
+        self.bucket = TokenBucket(bandwidth)
+        self._calls_lock = threading.Lock()
+        self.calls = Counter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    @property
+    def bandwidth(self):
+        return self.bucket.rate
+
+    @property
+    def round_trips(self):
+        """Calls made to the filesystem, without the reads and writes"""
+        return sum(self.calls.values())
+
+    def reset(self):
+        """Restart the counters"""
+        with self._calls_lock:
+            self.calls = Counter()
+            self.bytes_read = 0
+            self.bytes_written = 0
+
+    def exceeded(self, budget):
+        """Methods with more calls than budget allows, budget is a dict
+        of method to max calls, 'total' limits all the calls.
+        :return: dict of method to (calls, max calls)"""
+        res = {}
+        for method, limit in budget.items():
+            count = self.round_trips if method == 'total' else self.calls[method]
+            if count > limit:
+                res[method] = (count, limit)
+        return res
+
+    def _call(self, method, *args, **kwargs):
+        with self._calls_lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return super(LatencyFS, self)._call(method, *args, **kwargs)
+
+    def _io(self, nbytes, read):
+        with self._calls_lock:
+            if read:
+                self.bytes_read += nbytes
+            else:
+                self.bytes_written += nbytes
+        if self.latency:
+            time.sleep(self.latency)
+        if nbytes:
+            self.bucket.consume(nbytes)
+
+    def getsyspath(self, path):
+        raise NoSysPath(path=path)
+
+    def hassyspath(self, path):
+        return False
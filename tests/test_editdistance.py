@@ -0,0 +1,84 @@
+"""editDistance, distances and closest against the plain dynamic
+programming of the Levenshtein distance (the implementation before the
+bit-parallel one)."""
+import random
+
+from fssync.utils import editDistance, distances, closest
+
+ALPHABET = 'abcAB .-1'
+
+
+def _dp(a, b):
+    prev = list(range(len(a) + 1))
+    for i, cb in enumerate(b, 1):
+        cur = [i] + [0]*len(a)
+        for j, ca in enumerate(a, 1):
+            if ca == cb:
+                cur[j] = prev[j-1]
+            else:
+                cur[j] = min(prev[j-1], cur[j-1], prev[j]) + 1
+        prev = cur
+    return prev[-1]
+
+
+def _word(rnd, maxlen):
+    return ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randint(0, maxlen)))
+
+
+def _pairs(count=20000, maxlen=12, seed=9):
+    rnd = random.Random(seed)
+    pairs = [(_word(rnd, maxlen), _word(rnd, maxlen)) for _ in range(count)]
+    # longer than a machine word of bits
+    pairs += [(_word(rnd, 150), _word(rnd, 150)) for _ in range(50)]
+    return pairs
+
+
+def test_edit_distance_matches_dp():
+    for a, b in _pairs():
+        assert editDistance(a, b) == _dp(a, b), (a, b)
+
+
+def test_edit_distance_lower():
+    for a, b in _pairs(2000):
+        assert editDistance(a, b, lower=True) == _dp(a.lower(), b.lower()), (a, b)
+
+
+def test_edit_distance_limit():
+    # the exact distance below limit, limit once the distance reaches it
+    for a, b in _pairs(5000):
+        d = _dp(a, b)
+        for limit in (1, 2, 3, 5, 8):
+            assert editDistance(a, b, limit=limit) == min(d, limit), (a, b, limit)
+
+
+def test_distances():
+    rnd = random.Random(3)
+    for _ in range(200):
+        a = _word(rnd, 12)
+        candidates = [_word(rnd, 12) for _ in range(10)]
+        assert distances(a, candidates) == [_dp(a, c) for c in candidates]
+        assert distances(a, candidates, lower=True) == \
+            [_dp(a.lower(), c.lower()) for c in candidates]
+        assert distances(a, candidates, limit=4) == \
+            [min(_dp(a, c), 4) for c in candidates]
+
+
+def test_closest():
+    rnd = random.Random(5)
+    for _ in range(500):
+        a = _word(rnd, 12)
+        candidates = [_word(rnd, 12) for _ in range(10)]
+        limit = rnd.randint(1, 8)
+        best, dist = closest(a, candidates, limit)
+        below = [(_dp(a, c), i) for i, c in enumerate(candidates) if _dp(a, c) < limit]
+        if not below:
+            assert (best, dist) == (None, limit)
+        else:
+            # the first of the candidates with the smallest distance
+            d, i = min(below)
+            assert (best, dist) == (candidates[i], d)
+
+
+def test_closest_lower():
+    assert closest('naruto', ['Bleach', 'NARUTO', 'Naruto'], 3, lower=True) == ('NARUTO', 0)
+    assert closest('naruto', ['Bleach', 'NARUTO'], 3) == (None, 3)
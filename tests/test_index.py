@@ -0,0 +1,110 @@
+"""TitleIndex (BK-tree) against the brute force search over all the titles."""
+import random
+
+from fssync.index import TitleIndex
+from fssync.utils import editDistance, temp_format, temp_gap
+from fssync.dsync import SeriesPerson
+
+WORDS = ['naruto', 'Naruto', 'bleach', 'one', 'piece', 'shippuden', 'the', 'office',
+         'breaking', 'bad', 'Bad', 'dr', 'stone', 'boruto', 'bleak', 'peace']
+
+
+def _titles(rnd, count):
+    return [' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 3)))
+            for _ in range(count)]
+
+
+def _brute(titles, lower):
+    """normalized title to the first (title, value) added with it"""
+    res = {}
+    for title, value in titles:
+        key = title.lower() if lower else title
+        res.setdefault(key, (title, value))
+    return res
+
+
+def _cases(lower, seed):
+    rnd = random.Random(seed)
+    for _ in range(60):
+        titles = [(t, rnd.randint(0, 5)) for t in _titles(rnd, rnd.randint(0, 40))]
+        index = TitleIndex(titles, lower=lower)
+        entries = _brute(titles, lower)
+        for query in _titles(rnd, 10) + [t for t, _ in titles[:3]]:
+            yield index, entries, query, rnd.randint(1, 12)
+
+
+def _distance(a, b, lower):
+    return editDistance(a, b, lower=lower)
+
+
+def test_search_matches_brute_force():
+    for lower in (False, True):
+        for index, entries, query, limit in _cases(lower, 1):
+            expected = sorted((_distance(query, key, lower), ) + value
+                              for key, value in entries.items()
+                              if _distance(query, key, lower) < limit)
+            assert sorted(index.search(query, limit)) == expected, (query, limit)
+            assert len(index) == len(entries)
+
+
+def test_nearest_matches_brute_force():
+    for lower in (False, True):
+        for index, entries, query, limit in _cases(lower, 2):
+            found = [(_distance(query, key, lower), ) + value
+                     for key, value in entries.items()
+                     if _distance(query, key, lower) < limit]
+            res = index.nearest(query, limit)
+            if not found:
+                assert res is None, (query, limit)
+                continue
+            # any of the titles with the smallest distance
+            assert res in found and res[0] == min(found)[0], (query, limit, res)
+
+
+def test_plain_titles_and_contains():
+    index = TitleIndex(['Naruto', 'Bleach'], lower=True)
+    assert 'NARUTO' in index
+    assert 'Boruto' not in index
+    assert index.nearest('naruto', 1) == (0, 'Naruto', None)
+    assert index.nearest('Boruto', 2) is None
+    assert index.nearest('Boruto', 3) == (2, 'Naruto', None)
+    assert TitleIndex().search('x', 5) == []
+    assert TitleIndex().nearest('x', 5) is None
+
+
+def _closest_brute(fils, title, gap):
+    """the loop of SeriesPerson before the TitleIndex"""
+    best = None
+    best_gap = temp_gap + 10
+    for i, v in fils:
+        n = editDistance(i, title)
+        if n < temp_gap*v + (1-v)*gap and n < best_gap:
+            best = i
+            best_gap = n
+        elif n == 0:
+            best = i
+            break
+    return best
+
+
+def test_closest_folder_matches_brute_force():
+    rnd = random.Random(4)
+    for _ in range(300):
+        fils = set()
+        for title in _titles(rnd, rnd.randint(2, 8)):
+            if rnd.random() < 0.5:
+                fils.add((title + ' - ' + temp_format(rnd.randint(1, 12)), 1))
+            else:
+                fils.add((title, 0))
+        query = rnd.choice(_titles(rnd, 1) + [i for i, _ in fils])
+        if rnd.random() < 0.5:
+            query += ' - ' + temp_format(rnd.randint(1, 12))
+        gap = rnd.choice((2, 3))
+        res = SeriesPerson._closest_folder(TitleIndex(fils), query, gap)
+        expected = _closest_brute(fils, query, gap)
+        if expected is None:
+            assert res is None, (fils, query)
+        else:
+            # the brute force keeps the first of the ties in set order
+            assert res is not None, (fils, query)
+            assert editDistance(res, query) == editDistance(expected, query)
@@ -0,0 +1,48 @@
+"""Golden output of rename_serie and transform.
+
+data/rename_serie_golden.jsonl has, for each name, the result (or the
+error) of the parser before its optimization: release names of anime and
+series, the names of the benchmark corpus and fuzzed combinations of
+their tokens. Any change of the output is a regression, unless it is
+wanted; then regenerate the file with
+
+    python tests/test_parser_serie.py
+"""
+import os
+import sys
+import json
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                      'rename_serie_golden.jsonl')
+
+
+def _load():
+    with open(GOLDEN, encoding='utf-8') as afile:
+        return [json.loads(line) for line in afile if line.strip()]
+
+
+def _run(name):
+    from fssync.parser_serie import rename_serie, transform
+    try:
+        res = {'name': name, 'result': list(rename_serie(name))}
+    except Exception as e:
+        res = {'name': name, 'error': type(e).__name__}
+    res['transform'] = transform(name)
+    return res
+
+
+def test_rename_serie_golden():
+    cases = _load()
+    assert len(cases) > 5000
+    diffs = [(case, got) for case, got in ((i, _run(i['name'])) for i in cases)
+             if case != got]
+    assert not diffs, '{} of {} names changed, first: {}'.format(
+        len(diffs), len(cases), diffs[:5])
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    cases = [_run(i['name']) for i in _load()]
+    with open(GOLDEN, 'w', encoding='utf-8') as afile:
+        for case in cases:
+            afile.write(json.dumps(case, ensure_ascii=False) + '\n')
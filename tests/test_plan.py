@@ -0,0 +1,140 @@
+"""Decisions of DSync.plan on MemoryFS, and the SyncPlan round trip."""
+import fs.copy
+from fs.memoryfs import MemoryFS
+
+from fssync.dsync import SeriesAnimes, RENAME, OVERWRITE, sync
+from fssync.plan import SyncPlan, COPY, OVERWRITE as OP_OVERWRITE, RENAME_COPY, SKIP
+
+
+def _library():
+    src = MemoryFS()
+    src.makedirs('/d')
+    src.makedirs('/e')
+    src.writebytes('/d/[HS] Naruto - 01.mkv', b'a'*10)
+    # two sources for the same destination, the bigger is copied
+    src.writebytes('/d/[HS] Naruto - 02.mkv', b'b'*10)
+    src.writebytes('/e/[XX] Naruto - 02.mkv', b'c'*20)
+    src.writebytes('/d/[HS] Naruto - 03.mkv', b'd'*10)
+    src.writebytes('/d/[HS] Naruto - 04.mkv', b'e'*10)
+    src.writebytes('/d/[HS] Naruto - 05.mkv', b'f'*10)
+    src.writebytes('/d/[HS] Naruto - 06.mkv', b'g'*10)
+    dst = MemoryFS()
+    dst.makedir('/Naruto')
+    dst.writebytes('/Naruto/Naruto - 03.mkv', b'd'*5)
+    dst.writebytes('/Naruto/Naruto - 04.mkv', b'x'*20)
+    dst.writebytes('/Naruto/Naruto - 05.mkv', b'f'*10)
+    # same size, other content
+    dst.writebytes('/Naruto/Naruto - 06.mkv', b'z'*10)
+    return src, dst
+
+
+def _plan(collition, use_hash=True):
+    src, dst = _library()
+    # without with, the filesystems stay open for the checks
+    return SeriesAnimes(src, dst).plan(use_hash, collition), src, dst
+
+
+def _by_src(plan):
+    return {op.src: op for op in plan}
+
+
+def test_plan_decisions():
+    plan, _, _ = _plan(OVERWRITE)
+    ops = _by_src(plan)
+    assert len(ops) == len(plan) == 7
+    new = ops['/d/[HS] Naruto - 01.mkv']
+    assert (new.kind, new.dst, new.size, new.reason) == \
+        (COPY, '/Naruto/Naruto - 01.mkv', 10, 'new')
+    bigger = ops['/d/[HS] Naruto - 03.mkv']
+    assert (bigger.kind, bigger.dst, bigger.reason) == \
+        (OP_OVERWRITE, '/Naruto/Naruto - 03.mkv', 'bigger')
+    smaller = ops['/d/[HS] Naruto - 04.mkv']
+    assert (smaller.kind, smaller.reason) == (SKIP, 'smaller')
+    same = ops['/d/[HS] Naruto - 05.mkv']
+    assert (same.kind, same.reason) == (SKIP, 'same content')
+    collition = ops['/d/[HS] Naruto - 06.mkv']
+    assert (collition.kind, collition.dst, collition.reason) == \
+        (OP_OVERWRITE, '/Naruto/Naruto - 06.mkv', 'collition')
+    assert plan.folders == []
+
+
+def test_plan_two_sources_same_destination():
+    plan, _, _ = _plan(OVERWRITE)
+    ops = _by_src(plan)
+    kept = ops['/e/[XX] Naruto - 02.mkv']
+    dropped = ops['/d/[HS] Naruto - 02.mkv']
+    assert (kept.kind, kept.dst, kept.size) == (COPY, '/Naruto/Naruto - 02.mkv', 20)
+    assert dropped.kind == SKIP and dropped.dst == kept.dst
+    assert [op.dst for op in plan.transfers()].count(kept.dst) == 1
+
+
+def test_plan_collition_rename():
+    plan, _, _ = _plan(RENAME)
+    op = _by_src(plan)['/d/[HS] Naruto - 06.mkv']
+    assert (op.kind, op.dst, op.rename_to, op.reason) == \
+        (RENAME_COPY, '/Naruto/Naruto - 06.mkv', '/Naruto/Naruto - 06_rename_2.mkv',
+         'collition')
+
+
+def test_plan_without_hash():
+    # same size is a collition when the content is not compared
+    plan, _, _ = _plan(OVERWRITE, use_hash=False)
+    op = _by_src(plan)['/d/[HS] Naruto - 05.mkv']
+    assert (op.kind, op.reason) == (OP_OVERWRITE, 'collition')
+
+
+def test_plan_new_folder():
+    src, _ = _library()
+    with SeriesAnimes(src, MemoryFS()) as tt:
+        plan = tt.plan()
+    assert plan.folders == ['/Naruto']
+    assert plan.count(COPY) == 6 and plan.count(SKIP) == 1
+
+
+def test_plan_does_not_touch_dest():
+    plan, _, dst = _plan(RENAME)
+    assert sorted(dst.listdir('/Naruto')) == \
+        ['Naruto - 03.mkv', 'Naruto - 04.mkv', 'Naruto - 05.mkv', 'Naruto - 06.mkv']
+    assert dst.readbytes('/Naruto/Naruto - 03.mkv') == b'd'*5
+
+
+def test_execute_plan():
+    src, dst = _library()
+    tt = SeriesAnimes(src, dst)
+    tt.execute(tt.plan(True, RENAME), workers=2)
+    assert sorted(dst.listdir('/Naruto')) == \
+        ['Naruto - 01.mkv', 'Naruto - 02.mkv', 'Naruto - 03.mkv', 'Naruto - 04.mkv',
+         'Naruto - 05.mkv', 'Naruto - 06.mkv', 'Naruto - 06_rename_2.mkv']
+    assert dst.readbytes('/Naruto/Naruto - 02.mkv') == b'c'*20
+    assert dst.readbytes('/Naruto/Naruto - 03.mkv') == b'd'*10
+    assert dst.readbytes('/Naruto/Naruto - 04.mkv') == b'x'*20
+    assert dst.readbytes('/Naruto/Naruto - 06.mkv') == b'g'*10
+    assert dst.readbytes('/Naruto/Naruto - 06_rename_2.mkv') == b'z'*10
+
+
+def test_sync_dry_run(tmp_path):
+    src, dst = _library()
+    src_dir = tmp_path / 'src'
+    dst_dir = tmp_path / 'dst'
+    src_dir.mkdir()
+    dst_dir.mkdir()
+    fs.copy.copy_fs(src, str(src_dir))
+    fs.copy.copy_fs(dst, str(dst_dir))
+    before = sorted(str(i.relative_to(dst_dir)) for i in dst_dir.rglob('*'))
+    plan = sync(str(src_dir), str(dst_dir), use_hash=True, collition=RENAME, dry_run=True)
+    assert isinstance(plan, SyncPlan)
+    assert plan.summary() == {COPY: 2, OP_OVERWRITE: 1, RENAME_COPY: 1, SKIP: 3,
+                              'folders': 0, 'bytes': 50}
+    assert sorted(str(i.relative_to(dst_dir)) for i in dst_dir.rglob('*')) == before
+    assert (dst_dir / 'Naruto' / 'Naruto - 03.mkv').read_bytes() == b'd'*5
+
+
+def test_plan_json_round_trip():
+    plan, _, _ = _plan(RENAME)
+    plan.makedir('/Other')
+    again = SyncPlan.from_json(plan.to_json())
+    assert again.to_dict() == plan.to_dict()
+    assert again.folders == ['/Other']
+    assert [op.to_dict() for op in again] == [op.to_dict() for op in plan]
+    assert again.describe() == plan.describe()
+    assert again.summary() == plan.summary()
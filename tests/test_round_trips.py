@@ -0,0 +1,66 @@
+"""Round trips of sync and organize through LatencyFS, each call to a remote
+filesystem is a round trip, so the counts must not grow with regressions."""
+from fs.memoryfs import MemoryFS
+
+from fssync.wrap import LatencyFS
+from fssync.dsync import SeriesAnimes
+
+FOLDERS = 3
+EPISODES = 10
+# videos and one subtitle per folder
+FILES = FOLDERS*(EPISODES + 1)
+
+
+def _library():
+    src = MemoryFS()
+    for d in range(FOLDERS):
+        src.makedirs('/d{}'.format(d))
+        for e in range(1, EPISODES + 1):
+            src.writebytes('/d{0}/[HS] Show{0} - {1:02d}.mkv'.format(d, e), b'x'*(100 + e))
+        src.writebytes('/d{0}/[HS] Show{0} - 01.srt'.format(d), b's')
+    return src
+
+
+def _check(fsi, budget):
+    assert not fsi.exceeded(budget), (fsi.exceeded(budget), dict(fsi.calls))
+
+
+def test_exceeded():
+    slow = LatencyFS(MemoryFS())
+    slow.exists('/a')
+    slow.exists('/b')
+    slow.makedir('/c')
+    assert slow.round_trips == 3
+    assert slow.exceeded({'exists': 2, 'total': 3}) == {}
+    assert slow.exceeded({'exists': 1, 'total': 2, 'getinfo': 0}) == \
+        {'exists': (2, 1), 'total': (3, 2)}
+    slow.reset()
+    assert slow.round_trips == 0
+
+
+def test_sync_round_trips():
+    src = LatencyFS(_library())
+    dst = LatencyFS(MemoryFS())
+    SeriesAnimes(src, dst).sync(workers=2)
+    # the walk gives the details, no getinfo per file; one open per copy
+    _check(src, {'getinfo': 0, 'exists': 0, 'scandir': FOLDERS + 1,
+                 'openbin': FILES, 'total': FILES + FOLDERS + 1})
+    _check(dst, {'getinfo': 0, 'exists': 2*FOLDERS, 'makedir': FOLDERS,
+                 'openbin': FILES, 'total': FILES + 3*FOLDERS})
+
+    # everything is there, only the content of the files is compared
+    src.reset()
+    dst.reset()
+    SeriesAnimes(src, dst).sync(workers=2)
+    _check(src, {'getinfo': 0, 'openbin': FILES, 'total': FILES + FOLDERS + 1})
+    _check(dst, {'getinfo': 0, 'exists': FOLDERS, 'scandir': FOLDERS, 'makedir': 0,
+                 'openbin': FILES, 'total': FILES + 2*FOLDERS})
+
+
+def test_organize_round_trips():
+    slow = LatencyFS(_library())
+    with SeriesAnimes(MemoryFS(), slow) as tt:
+        tt.organize()
+    # one move per file, nothing is read
+    _check(slow, {'getinfo': 0, 'openbin': 0, 'exists': FOLDERS, 'move': FILES,
+                  'scandir': FOLDERS + 2, 'total': FILES + 4*FOLDERS + 2})